@@ -1,7 +1,6 @@
 from flask import Flask, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import os
 
 from dotenv import load_dotenv
 
@@ -42,8 +41,9 @@ def create_app():
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
         return response
     
-    # Configure the database URI from environment variables
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
+    # Configure the database URI, pool options and optional read replica from environment variables
+    from .database import configure_database
+    configure_database(app)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
     # Initialize the database with the Flask app
@@ -69,4 +69,26 @@ def create_app():
     def health_check():
         return {'status': 'healthy', 'message': 'LazyLedger API is running'}
 
+    # Readiness for load balancers: 503 until warmed-up resources are loaded
+    @app.route('/ready')
+    def ready():
+        from .readiness import readiness
+        is_ready, resources = readiness()
+        return {'status': 'ready' if is_ready else 'starting', 'resources': resources}, 200 if is_ready else 503
+
+    # Counters from caches and other components, for scraping
+    @app.route('/metrics')
+    def metrics():
+        from .metrics import collect_metrics
+        return collect_metrics()
+
+    # This worker's RSS/PSS, to see how much of it is shared with the gunicorn master
+    from .memory import process_memory
+    from .metrics import register_metrics
+    register_metrics('process_memory', process_memory)
+
+    # Optionally load the NLP model and insight backend now instead of on first request
+    from .readiness import start_warmup
+    start_warmup()
+
     return app
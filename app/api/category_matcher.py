@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Category keywords, checked in order (first matching category wins)
+DEFAULT_CATEGORY_KEYWORDS = {
+    "groceries": ["groceries", "supermarket", "food"],
+    "entertainment": ["netflix", "spotify", "movies", "game"],
+    "salary": ["salary", "income", "paycheck", "got"],
+    "freelance": ["freelance", "project"],
+    "transport": ["bus", "uber", "train", "taxi", "wheel", "pickme"],
+    "bills": ["electricity", "water", "bill", "mobile", "reload"],
+    "food": ["restaurant", "cafe", "dinner", "lunch", "breakfast", "snack", "tea", "coffee"],
+}
+DEFAULT_INCOME_KEYWORDS = ["got", "received", "income", "salary", "paid me"]
+DEFAULT_CATEGORY = "other"
+
+AMOUNT_PATTERN = r"\b\d+(?:\.\d{1,2})?\b"
+
+# Optional JSON rules file: {"categories": {...}, "income_keywords": [...]}
+CATEGORY_RULES_PATH = os.environ.get('CATEGORY_RULES_PATH')
+
+
+def _trie_pattern(words):
+    """Build a regex from a keyword trie so matching cost does not grow with the keyword count.
+
+    Child branches are tried before stopping at a terminal node, so at any
+    position the regex matches the longest keyword that starts there.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            body = '(?:' + body + ')?'
+        return body
+
+    return build(trie)
+
+
+class CategoryMatcher:
+    """Keyword rules compiled into one regex that finds category, income flag and amount in a single pass"""
+
+    def __init__(self, category_keywords, income_keywords, default_category=DEFAULT_CATEGORY):
+        self.category_keywords = {
+            category: [w.lower() for w in keywords if w]
+            for category, keywords in category_keywords.items()
+        }
+        self.income_keywords = [w.lower() for w in income_keywords if w]
+        self.default_category = default_category
+        self.categories = list(self.category_keywords)
+
+        # Exact keyword -> (category priority or None, is_income)
+        priorities = {}
+        for priority, keywords in enumerate(self.category_keywords.values()):
+            for word in keywords:
+                priorities.setdefault(word, priority)
+        income = set(self.income_keywords)
+        words = set(priorities) | income
+
+        # The regex reports only the longest keyword at each position, and every
+        # other keyword matching there is a prefix of it, so fold the prefixes'
+        # info into each keyword up front.
+        self._keywords = {}
+        for word in words:
+            prefixes = [word[:i] for i in range(1, len(word) + 1)]
+            ranks = [priorities[p] for p in prefixes if p in priorities]
+            self._keywords[word] = (min(ranks) if ranks else None, any(p in income for p in prefixes))
+
+        if words:
+            pattern = '(?=(?P<kw>' + _trie_pattern(words) + '))|(?P<amount>' + AMOUNT_PATTERN + ')'
+        else:
+            pattern = '(?P<amount>' + AMOUNT_PATTERN + ')'
+        self._pattern = re.compile(pattern)
+
+    def lookup(self, word):
+        """Return (category, is_income) for an exact keyword"""
+        priority, is_income = self._keywords.get(word.lower(), (None, False))
+        return (self.categories[priority] if priority is not None else None), is_income
+
+    def match(self, text):
+        """Return (category, is_income, amount) for a line of text"""
+        best = None
+        is_income = False
+        amount = None
+        for m in self._pattern.finditer(text.lower()):
+            amount_text = m.group('amount')
+            if amount_text is not None:
+                if amount is None:
+                    amount = float(amount_text)
+                continue
+            priority, income = self._keywords[m.group('kw')]
+            if priority is not None and (best is None or priority < best):
+                best = priority
+            is_income = is_income or income
+        category = self.categories[best] if best is not None else self.default_category
+        return category, is_income, amount
+
+
+def load_category_rules(path):
+    """Build a CategoryMatcher from a JSON rules file"""
+    with open(path, encoding='utf-8') as f:
+        rules = json.load(f)
+    return CategoryMatcher(
+        rules.get('categories', DEFAULT_CATEGORY_KEYWORDS),
+        rules.get('income_keywords', DEFAULT_INCOME_KEYWORDS),
+    )
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_category_matcher():
+    """Return the active matcher, compiling the configured rules on first use"""
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                if CATEGORY_RULES_PATH:
+                    _matcher = load_category_rules(CATEGORY_RULES_PATH)
+                    logger.info('Loaded category rules from %s', CATEGORY_RULES_PATH)
+                else:
+                    _matcher = CategoryMatcher(DEFAULT_CATEGORY_KEYWORDS, DEFAULT_INCOME_KEYWORDS)
+    return _matcher
+
+
+def set_category_matcher(matcher):
+    """Swap in a new matcher (e.g. after editing the rules file)"""
+    global _matcher
+    with _matcher_lock:
+        _matcher = matcher
+    return matcher
+
+
+def reload_category_rules(path=None):
+    """Recompile rules from a file, or the built-in defaults when no path is configured"""
+    path = path or CATEGORY_RULES_PATH
+    if path:
+        return set_category_matcher(load_category_rules(path))
+    return set_category_matcher(CategoryMatcher(DEFAULT_CATEGORY_KEYWORDS, DEFAULT_INCOME_KEYWORDS))
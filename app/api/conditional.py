@@ -0,0 +1,39 @@
+import hashlib
+from datetime import timezone
+
+from flask import make_response, request
+
+
+def make_etag(*parts):
+    """Strong ETag from the validator parts (e.g. row count, max(created_at), query string)"""
+    raw = '|'.join('' if part is None else str(part) for part in parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def _as_utc(last_modified):
+    # Stored timestamps are naive UTC; HTTP dates have whole-second resolution
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return last_modified.replace(microsecond=0)
+
+
+def is_not_modified(etag, last_modified=None):
+    """Whether the client's cached copy is still current; If-None-Match wins over If-Modified-Since"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return _as_utc(last_modified) <= request.if_modified_since
+    return False
+
+
+def set_validators(response, etag, last_modified=None):
+    """Attach ETag/Last-Modified and ask clients to revalidate before reusing the body"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _as_utc(last_modified)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified_response(etag, last_modified=None):
+    return set_validators(make_response('', 304), etag, last_modified)
@@ -0,0 +1,195 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from .. import db
+from ..metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# Opt-in group commit for /raw-records/create: records are buffered and written by a
+# background flusher, many per transaction. The buffer is per process, so in sync mode
+# batches only form across concurrent requests in one worker (gunicorn GUNICORN_THREADS > 1)
+RAW_RECORD_BUFFER_ENABLED = os.environ.get('RAW_RECORD_BUFFER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Records waiting for the flusher before new ones are refused with 503
+RAW_RECORD_BUFFER_MAX_PENDING = int(os.environ.get('RAW_RECORD_BUFFER_MAX_PENDING', '5000'))
+# A batch is flushed once it has this many records or its first record is this old
+RAW_RECORD_BUFFER_BATCH_SIZE = int(os.environ.get('RAW_RECORD_BUFFER_BATCH_SIZE', '200'))
+RAW_RECORD_BUFFER_FLUSH_MS = int(os.environ.get('RAW_RECORD_BUFFER_FLUSH_MS', '20'))
+# sync: the request waits for its batch's commit (201); async: it returns 202 once buffered
+RAW_RECORD_BUFFER_DURABILITY = os.environ.get('RAW_RECORD_BUFFER_DURABILITY', 'sync').lower()
+if RAW_RECORD_BUFFER_DURABILITY not in ('sync', 'async'):
+    raise ValueError(f"RAW_RECORD_BUFFER_DURABILITY must be sync or async, got {RAW_RECORD_BUFFER_DURABILITY!r}")
+# Longest a sync request waits for its commit
+RAW_RECORD_BUFFER_WAIT_SECONDS = float(os.environ.get('RAW_RECORD_BUFFER_WAIT_SECONDS', '30'))
+
+
+class BufferFullError(Exception):
+    """Raised when the write-behind buffer cannot take more records"""
+
+
+class PendingRecord:
+    """One buffered raw record; done is set once its batch has committed or failed"""
+
+    def __init__(self, user_id, date, raw_text, transactions):
+        self.user_id = user_id
+        self.date = date
+        self.raw_text = raw_text
+        self.transactions = transactions
+        self.raw_entry = None
+        self.saved_transactions = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class WriteBehindBuffer:
+    """Bounded queue of raw records written by one flusher thread in batched transactions"""
+
+    def __init__(self, app, max_pending=RAW_RECORD_BUFFER_MAX_PENDING, batch_size=RAW_RECORD_BUFFER_BATCH_SIZE,
+                 flush_ms=RAW_RECORD_BUFFER_FLUSH_MS):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        # Records handed in but not yet written, and the most seen at once
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self.counters = {'accepted': 0, 'rejected': 0, 'flushed': 0, 'failed': 0, 'batches': 0,
+                         'flush_seconds_total': 0.0, 'flush_seconds_max': 0.0, 'batch_size_max': 0}
+        self._thread = threading.Thread(target=self._run, name='raw-record-flusher', daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, date, raw_text, transactions):
+        """Buffer a parsed raw record; raises BufferFullError instead of blocking"""
+        record = PendingRecord(user_id, date, raw_text, transactions)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.counters['rejected'] += 1
+            raise BufferFullError(f'{self._queue.qsize()} raw records already waiting to be written')
+        with self._lock:
+            self.counters['accepted'] += 1
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        return record
+
+    def _should_wait(self):
+        """Whether holding a batch open for flush_interval can gather more records.
+
+        A sync request blocks until its record is written, so with one request thread per
+        process (never more than one record in flight) waiting only adds latency.
+        """
+        if RAW_RECORD_BUFFER_DURABILITY == 'async':
+            return True
+        with self._lock:
+            return self._max_in_flight > 1
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        if not self._should_wait():
+            return batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        from .raw_records import insert_raw_entry, insert_transactions
+        from ..insights.rollups import apply_transactions as apply_to_rollups
+
+        start = time.perf_counter()
+        written = []
+        with self.app.app_context():
+            try:
+                # One user order for every batch, so concurrent flushers take rollup locks consistently
+                for record in sorted(batch, key=lambda r: str(r.user_id)):
+                    try:
+                        # A savepoint per record: a bad record fails alone, not the whole batch
+                        with db.session.begin_nested():
+                            raw_entry = insert_raw_entry(record.user_id, record.date, record.raw_text)
+                            saved = insert_transactions(record.user_id, record.transactions)
+                            apply_to_rollups(record.user_id, record.transactions)
+                        record.raw_entry = dict(raw_entry._mapping) if raw_entry else None
+                        record.saved_transactions = [dict(t._mapping) for t in saved]
+                        written.append(record)
+                    except Exception as e:
+                        logger.warning('Dropping raw record for user %s: %s', record.user_id, e)
+                        record.error = str(e)
+                db.session.commit()
+            except Exception as e:
+                logger.exception('Raw record batch of %d failed to commit', len(batch))
+                db.session.rollback()
+                for record in written:
+                    record.error = str(e)
+                written = []
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.counters['flushed'] += len(written)
+            self.counters['failed'] += len(batch) - len(written)
+            self.counters['batches'] += 1
+            self.counters['flush_seconds_total'] += elapsed
+            self.counters['flush_seconds_max'] = max(self.counters['flush_seconds_max'], elapsed)
+            self.counters['batch_size_max'] = max(self.counters['batch_size_max'], len(batch))
+            self._in_flight -= len(batch)
+        for record in batch:
+            record.done.set()
+
+    def shutdown(self, timeout=10):
+        """Write out what is already buffered, then stop the flusher"""
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        batches = counters['batches']
+        uptime = time.time() - self._started_at
+        return {
+            'durability': RAW_RECORD_BUFFER_DURABILITY,
+            'pending': self._queue.qsize(),
+            'max_in_flight': self._max_in_flight,
+            'max_pending': self._queue.maxsize,
+            **counters,
+            'avg_batch_size': (counters['flushed'] + counters['failed']) / batches if batches else 0.0,
+            'avg_flush_ms': counters['flush_seconds_total'] / batches * 1000 if batches else 0.0,
+            'records_per_second': counters['flushed'] / uptime if uptime else 0.0,
+        }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_write_buffer(app):
+    """The process-wide buffer, started on first use (after any gunicorn fork)"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = WriteBehindBuffer(app)
+                register_metrics('raw_record_buffer', _buffer.stats)
+                atexit.register(_buffer.shutdown)
+    return _buffer
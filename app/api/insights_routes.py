@@ -1,5 +1,8 @@
-from flask import Blueprint, jsonify
+from datetime import datetime
+from flask import Blueprint, current_app, jsonify, url_for
 from ..insights.generate_insights import generate_insights, get_latest_insight
+from ..insights.jobs import QueueFullError, get_job_runner
+from .conditional import is_not_modified, make_etag, not_modified_response, set_validators
 
 # Create the insights blueprint
 insights_bp = Blueprint('insights', __name__)
@@ -42,19 +45,76 @@ def get_latest_user_insight(user_id):
         if isinstance(latest_insight, str) and latest_insight.startswith("Error"):
             return jsonify({'error': latest_insight}), 500
         
+        # The latest insight id identifies the response; it changes only when a new insight is stored
+        etag = make_etag(user_id, latest_insight['insight_id'] if latest_insight else None)
+        last_modified = None
+        if latest_insight and latest_insight['created_at']:
+            last_modified = datetime.fromisoformat(latest_insight['created_at'])
+        if is_not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
         # Check if no insights found
         if latest_insight is None:
-            return jsonify({
+            response = jsonify({
                 'userId': user_id,
                 'message': 'No insights found for this user',
                 'insight': None
-            }), 200
+            })
+            return set_validators(response, etag), 200
         
         # Return the latest insight
-        return jsonify({
+        response = jsonify({
             'userId': user_id,
             'insight': latest_insight
-        }), 200
+        })
+        return set_validators(response, etag, last_modified), 200
         
     except Exception as e:
         return jsonify({'error': f'Error fetching latest insight: {str(e)}'}), 500
+
+
+def _job_response(job):
+    body = {
+        'jobId': job['job_id'],
+        'userId': job['user_id'],
+        'status': job['status'],
+        'createdAt': job['created_at'],
+        'updatedAt': job['updated_at'],
+    }
+    if job['result'] is not None:
+        body['insights'] = job['result']
+    if job['error'] is not None:
+        body['error'] = job['error']
+    return body
+
+
+@insights_bp.route('/insights/<user_id>/jobs', methods=['POST'])
+def create_insight_job(user_id):
+    """Queue insight generation in the background; a job already active for the user is reused"""
+    try:
+        if not user_id:
+            return jsonify({'error': 'userId is required'}), 400
+
+        job, created = get_job_runner().submit(current_app._get_current_object(), user_id)
+
+        response = jsonify({**_job_response(job), 'created': created})
+        response.headers['Location'] = url_for('insights.get_insight_job', job_id=job['job_id'])
+        return response, 202
+
+    except QueueFullError as e:
+        return jsonify({'error': f'Insight queue is full: {str(e)}'}), 503
+    except Exception as e:
+        return jsonify({'error': f'Error queueing insights: {str(e)}'}), 500
+
+
+@insights_bp.route('/insights/jobs/<job_id>', methods=['GET'])
+def get_insight_job(job_id):
+    """Status of an insight job, with the insights once it has succeeded"""
+    try:
+        job = get_job_runner().store.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(_job_response(job)), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Error fetching job: {str(e)}'}), 500
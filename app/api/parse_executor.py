@@ -0,0 +1,74 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .parser import parse_transactions
+
+logger = logging.getLogger(__name__)
+
+# Worker processes for large pastes (0 keeps all parsing in-process)
+PARSE_POOL_WORKERS = int(os.environ.get('PARSE_POOL_WORKERS', '0'))
+# Requests with fewer lines than this are parsed in-process
+PARSE_POOL_MIN_LINES = int(os.environ.get('PARSE_POOL_MIN_LINES', '1000'))
+# Lines per chunk handed to a worker
+PARSE_POOL_CHUNK_SIZE = int(os.environ.get('PARSE_POOL_CHUNK_SIZE', '250'))
+# spawn avoids inheriting locks/threads from a running web worker
+PARSE_POOL_START_METHOD = os.environ.get('PARSE_POOL_START_METHOD', 'spawn')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    """Load the NLP model once per worker process, before any chunk arrives"""
+    from . import parser
+    if parser.PARSER_ENGINE != 'rules':
+        parser.get_nlp()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=PARSE_POOL_WORKERS,
+                    mp_context=multiprocessing.get_context(PARSE_POOL_START_METHOD),
+                    initializer=_init_worker,
+                )
+                logger.info('Started parse pool with %d workers', PARSE_POOL_WORKERS)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+atexit.register(shutdown_executor)
+
+
+def parse_lines(lines):
+    """Parse lines, fanning large inputs out to the process pool in order-preserving chunks"""
+    lines = list(lines)
+    if PARSE_POOL_WORKERS <= 0 or len(lines) < PARSE_POOL_MIN_LINES:
+        return parse_transactions(lines)
+
+    chunks = [lines[i:i + PARSE_POOL_CHUNK_SIZE] for i in range(0, len(lines), PARSE_POOL_CHUNK_SIZE)]
+    try:
+        transactions = []
+        # map() yields results in submission order, so chunks reassemble in line order
+        for chunk_result in get_executor().map(parse_transactions, chunks):
+            transactions.extend(chunk_result)
+        return transactions
+    except BrokenProcessPool:
+        logger.exception('Parse pool broke, parsing %d lines in-process', len(lines))
+        shutdown_executor()
+        return parse_transactions(lines)
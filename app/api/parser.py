@@ -1,60 +1,280 @@
-from flask import Blueprint, request, jsonify
-import spacy
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+import json
+import os
 import re
 import time
 import logging
+import threading
+
+from .category_matcher import get_category_matcher
+from ..cache import LRUCache
+from ..metrics import register_metrics
+from ..readiness import register_resource
 
 logger = logging.getLogger(__name__)
 
 parser = Blueprint('parser', __name__)
-# load the spaCy model at import time (keeps model in memory for requests)
-nlp = spacy.load("en_core_web_sm")
 
-# ---- Transaction Parsing ----
-def parse_transaction(entry):
-    doc = nlp(entry)
-    amount = None
-    category = "other"
-    transaction_type = "expense"
-
-    # Extract amount
-    amount_match = re.search(r"\b\d+(?:\.\d{1,2})?\b", entry)
-    if amount_match:
-        amount = float(amount_match.group())
-
-    # Lowercase for keyword detection
-    entry_lower = entry.lower()
-
-    # Category keywords
-    category_keywords = {
-        "groceries": ["groceries", "supermarket", "food"],
-        "entertainment": ["netflix", "spotify", "movies", "game"],
-        "salary": ["salary", "income", "paycheck", "got"],
-        "freelance": ["freelance", "project"],
-        "transport": ["bus", "uber", "train", "taxi", "wheel", "pickme"],
-        "bills": ["electricity", "water", "bill", "mobile", "reload"],
-        "food": ["restaurant", "cafe", "dinner", "lunch", "breakfast", "snack", "tea", "coffee"],
-    }
+# Parser engine:
+#   rules  - regex + keywords only, spaCy is never loaded
+#   nlp    - run spaCy on every line as before; the rules' result is left unchanged
+#   hybrid - run spaCy only on lines the rules could not resolve, to fill in a missing amount
+PARSER_ENGINES = ('rules', 'nlp', 'hybrid')
+PARSER_ENGINE = os.environ.get('PARSER_ENGINE', 'hybrid').strip().lower()
+if PARSER_ENGINE not in PARSER_ENGINES:
+    raise ValueError(f"PARSER_ENGINE must be one of {', '.join(PARSER_ENGINES)}, got {PARSER_ENGINE!r}")
+
+# hybrid only: also recategorize 'other' lines from noun lemmas of the category keywords
+# (e.g. "movies" -> entertainment). Never touches the income/expense type.
+PARSER_LEMMA_CATEGORIES = os.environ.get('PARSER_LEMMA_CATEGORIES', 'false').lower() in ('1', 'true', 'yes')
+
+# Number of lines handed to spaCy at a time by parse_transactions
+PARSER_BATCH_SIZE = int(os.environ.get('PARSER_BATCH_SIZE', '256'))
+
+# Lines parsed per batch when streaming NDJSON responses
+PARSE_STREAM_BATCH_SIZE = int(os.environ.get('PARSE_STREAM_BATCH_SIZE', '64'))
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Pipeline components kept enabled for parsing. The dependency parser and
+# sentence recognizer are the slowest parts of en_core_web_sm and one-line
+# ledger entries never need them.
+SPACY_ENABLED_PIPES = [
+    name.strip()
+    for name in os.environ.get('SPACY_ENABLED_PIPES', 'tok2vec,tagger,attribute_ruler,lemmatizer,ner').split(',')
+    if name.strip()
+]
+
+# Parse results keyed by normalized line text (0 disables the cache)
+PARSE_CACHE_SIZE = int(os.environ.get('PARSE_CACHE_SIZE', '4096'))
+parse_cache = LRUCache(PARSE_CACHE_SIZE)
+register_metrics('parse_cache', parse_cache.stats)
+_cached_rules = None
+
+_nlp = None
+_keyword_lemmas = (None, {})
+_nlp_lock = threading.Lock()
+
+
+def get_nlp():
+    """Return the spaCy model, loading it on first use"""
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                import spacy
+
+                model = spacy.load("en_core_web_sm")
+                model.select_pipes(enable=[name for name in SPACY_ENABLED_PIPES if name in model.pipe_names])
+                _nlp = model
+                logger.info('Loaded spaCy model with pipes: %s', ', '.join(model.pipe_names))
+    return _nlp
+
+
+def _build_keyword_lemmas(model, matcher):
+    """Map the lemma of every single-word, non-income category keyword that is a noun to its category"""
+    lemmas = {}
+    words = [w for keywords in matcher.category_keywords.values() for w in keywords]
+    words = [w for w in dict.fromkeys(words) if ' ' not in w]
+    for word, doc in zip(words, model.pipe(words)):
+        if not len(doc) or doc[0].pos_ != 'NOUN':
+            continue
+        lemma = doc[0].lemma_.lower()
+        category, is_income = matcher.lookup(word)
+        # Income keywords ("got", "received") are verbs whose lemmas match far too much
+        if not lemma or lemma == word or is_income:
+            continue
+        lemmas.setdefault(lemma, category)
+    return lemmas
+
+
+def _get_keyword_lemmas(matcher):
+    """Keyword lemma table for the active rules, rebuilt when the rules change"""
+    global _keyword_lemmas
+    rules, lemmas = _keyword_lemmas
+    if rules is not matcher:
+        lemmas = _build_keyword_lemmas(get_nlp(), matcher)
+        _keyword_lemmas = (matcher, lemmas)
+    return lemmas
 
-    # Detect category
-    for key, keywords in category_keywords.items():
-        if any(word in entry_lower for word in keywords):
-            category = key
-            break
-
-    # Detect income
-    if any(w in entry_lower for w in ["got", "received", "income", "salary", "paid me"]):
-        transaction_type = "income"
 
+# ---- Transaction Parsing ----
+def _parse_rules(entry, matcher):
+    # Category, income flag and amount in one pass over the line
+    category, is_income, amount = matcher.match(entry)
     return {
         "amount": amount,
-        "type": transaction_type,
+        "type": "income" if is_income else "expense",
         "category": category
     }
 
 
+def _is_resolved(tx):
+    return tx["amount"] is not None and tx["category"] != "other"
+
+
+def _to_amount(value):
+    digits = re.sub(r"[^\d.]", "", value)
+    try:
+        return float(digits) if digits else None
+    except ValueError:
+        return None
+
+
+def _refine_with_doc(tx, doc, keyword_lemmas):
+    """Fill in what the rules missed using spaCy entities, numbers and noun lemmas"""
+    if tx["amount"] is None:
+        candidates = [ent.text for ent in doc.ents if ent.label_ in ("MONEY", "CARDINAL")]
+        candidates += [token.text for token in doc if token.like_num]
+        for candidate in candidates:
+            amount = _to_amount(candidate)
+            if amount is not None:
+                tx["amount"] = amount
+                break
+
+    if tx["category"] == "other" and keyword_lemmas:
+        for token in doc:
+            category = keyword_lemmas.get(token.lemma_.lower()) if token.pos_ == 'NOUN' else None
+            if category:
+                tx["category"] = category
+                break
+    return tx
+
+
+def _parse_uncached(entries, matcher, batch_size=None):
+    transactions = [_parse_rules(entry, matcher) for entry in entries]
+    if PARSER_ENGINE == 'rules':
+        return transactions
+
+    if PARSER_ENGINE == 'nlp':
+        # Same cost as always running spaCy, same result as the rules
+        for _ in get_nlp().pipe((entry for entry in entries if entry), batch_size=batch_size or PARSER_BATCH_SIZE):
+            pass
+        return transactions
+
+    pending = [i for i, tx in enumerate(transactions) if entries[i] and not _is_resolved(tx)]
+    if not pending:
+        return transactions
+
+    keyword_lemmas = _get_keyword_lemmas(matcher) if PARSER_LEMMA_CATEGORIES else {}
+    docs = get_nlp().pipe((entries[i] for i in pending), batch_size=batch_size or PARSER_BATCH_SIZE)
+    for i, doc in zip(pending, docs):
+        _refine_with_doc(transactions[i], doc, keyword_lemmas)
+    return transactions
+
+
+def normalize_entry(entry):
+    """Cache key for a line: collapsed whitespace, lowercased"""
+    return ' '.join(entry.split()).lower()
+
+
+def parse_transactions(lines, batch_size=None):
+    """Parse many entries at once; spaCy (when enabled) runs over them with nlp.pipe.
+
+    Results are memoized per normalized line, so repeated entries such as
+    "bus 50" skip parsing entirely. Callers always get fresh dicts.
+    """
+    global _cached_rules
+    matcher = get_category_matcher()
+    if _cached_rules is not matcher:
+        # Rules changed, cached categories may be stale
+        parse_cache.clear()
+        _cached_rules = matcher
+
+    entries = [' '.join(line.split()) for line in lines]
+    keys = [entry.lower() for entry in entries]
+    results = {}
+    misses = {}
+    for entry, key in zip(entries, keys):
+        if key in results or key in misses:
+            continue
+        cached = parse_cache.get(key)
+        if cached is None:
+            misses[key] = entry
+        else:
+            results[key] = cached
+
+    if misses:
+        parsed = _parse_uncached(list(misses.values()), matcher, batch_size)
+        for key, tx in zip(misses, parsed):
+            parse_cache.set(key, tx)
+            results[key] = tx
+
+    return [dict(results[key]) for key in keys]
+
+
+def parse_transaction(entry):
+    """Parse a single entry; prefer parse_transactions for multi-line input"""
+    return parse_transactions([entry])[0]
+
+
+# The model loads on first use; warmup (WARMUP_ON_START) can load it before traffic arrives
+if PARSER_ENGINE != 'rules':
+    register_resource('nlp_model', get_nlp, lambda: _nlp is not None)
+
+
+def _wants_ndjson():
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def _stream_parse():
+    """Parse the request body in small batches and stream one JSON object per line.
+
+    JSON bodies ({"raw_text": ..., "date": ...}) are accepted as on /parse-text.
+    Any other body is read incrementally as plain text, one entry per line,
+    with the date taken from the ?date= query parameter.
+    """
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        raw_text = data.get('raw_text', '')
+        default_date = data.get('date', None)
+        if not raw_text:
+            return jsonify({'error': 'No raw_text provided'}), 400
+        lines = iter(raw_text.strip().splitlines())
+    else:
+        default_date = request.args.get('date')
+        lines = (
+            line.decode('utf-8', errors='replace')
+            for line in request.stream
+            if line.strip()
+        )
+
+    def encode(batch):
+        chunk = []
+        for tx in parse_transactions(batch):
+            tx['date'] = default_date
+            chunk.append(json.dumps(tx) + '\n')
+        return ''.join(chunk)
+
+    def generate():
+        start = time.time()
+        count = 0
+        batch = []
+        try:
+            for line in lines:
+                batch.append(line)
+                if len(batch) >= PARSE_STREAM_BATCH_SIZE:
+                    yield encode(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                yield encode(batch)
+                count += len(batch)
+        except Exception:
+            # Headers are already sent, so report the failure in-band
+            logger.exception('Error while streaming parse_text after %d transactions', count)
+            yield json.dumps({'error': 'Internal Server Error'}) + '\n'
+            return
+        logger.info('parse_text stream: produced %d transactions in %.3fs', count, time.time() - start)
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
 @parser.route('/parse-text', methods=['POST'])
 def parse_text():
+    if _wants_ndjson():
+        return _stream_parse()
+
     start = time.time()
     try:
         data = request.get_json() or {}
@@ -65,18 +285,16 @@ def parse_text():
             logger.debug('parse_text called without raw_text')
             return jsonify({'error': 'No raw_text provided'}), 400
 
+        from .parse_executor import parse_lines
+
         lines = raw_text.strip().splitlines()
         logger.info('parse_text: processing %d lines', len(lines))
         transactions = []
 
-        for line in lines:
-            try:
-                tx = parse_transaction(line.strip())
-                if tx:
-                    tx['date'] = default_date
-                    transactions.append(tx)
-            except Exception:
-                logger.exception('Error parsing line: %s', line)
+        for tx in parse_lines(lines):
+            if tx:
+                tx['date'] = default_date
+                transactions.append(tx)
 
         duration = time.time() - start
         logger.info('parse_text: finished processing in %.3fs, produced %d transactions', duration, len(transactions))
@@ -88,81 +306,11 @@ def parse_text():
         return jsonify({'error': 'Internal Server Error'}), 500
 
 
-@parser.route('/health', methods=['GET'])
-def health():
-    return {"status": "healthy"}, 200
-
-from flask import Blueprint, request, jsonify
-import spacy
-import re
-
-parser = Blueprint('parser', __name__)
-nlp = spacy.load("en_core_web_sm")
-
-# ---- Transaction Parsing ----
-def parse_transaction(entry):
-    doc = nlp(entry)
-    amount = None
-    category = "other"
-    transaction_type = "expense"
-
-    # Extract amount
-    amount_match = re.search(r"\b\d+(?:\.\d{1,2})?\b", entry)
-    if amount_match:
-        amount = float(amount_match.group())
-
-    # Lowercase for keyword detection
-    entry_lower = entry.lower()
-
-    # Category keywords
-    category_keywords = {
-        "groceries": ["groceries", "supermarket", "food"],
-        "entertainment": ["netflix", "spotify", "movies", "game"],
-        "salary": ["salary", "income", "paycheck", "got"],
-        "freelance": ["freelance", "project"],
-        "transport": ["bus", "uber", "train", "taxi", "wheel", "pickme"],
-        "bills": ["electricity", "water", "bill", "mobile", "reload"],
-        "food": ["restaurant", "cafe", "dinner", "lunch", "breakfast", "snack", "tea", "coffee"],
-    }
-
-    # Detect category
-    for key, keywords in category_keywords.items():
-        if any(word in entry_lower for word in keywords):
-            category = key
-            break
-
-    # Detect income
-    if any(w in entry_lower for w in ["got", "received", "income", "salary", "paid me"]):
-        transaction_type = "income"
+@parser.route('/parse-text/stream', methods=['POST'])
+def parse_text_stream():
+    return _stream_parse()
 
-    return {
-        "amount": amount,
-        "type": transaction_type,
-        "category": category
-    }
-
-
-@parser.route('/parse-text', methods=['POST'])
-def parse_text():
-    data = request.get_json()
-    raw_text = data.get('raw_text', '')
-    default_date = data.get('date', None)
-
-    if not raw_text:
-        return jsonify({'error': 'No raw_text provided'}), 400
-
-    lines = raw_text.strip().splitlines()
-    transactions = []
-
-    for line in lines:
-        tx = parse_transaction(line.strip())
-        if tx:
-            tx['date'] = default_date  
-            transactions.append(tx)
-
-    return jsonify(transactions), 200
 
 @parser.route('/health', methods=['GET'])
 def health():
     return {"status": "healthy"}, 200
-
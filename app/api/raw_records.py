@@ -1,12 +1,93 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from .. import db
 from sqlalchemy import text
-from .parser import parse_transaction
+from .ingest_buffer import (RAW_RECORD_BUFFER_DURABILITY, RAW_RECORD_BUFFER_ENABLED, RAW_RECORD_BUFFER_WAIT_SECONDS,
+                            BufferFullError, get_write_buffer)
+from .parse_executor import parse_lines
+from ..insights.rollups import apply_transactions as apply_to_rollups
+from datetime import datetime
+import csv
+import io
 import logging
+import os
+import re
+import time
 
 raw_bp = Blueprint('raw_records', __name__)
 logger = logging.getLogger(__name__)
 
+# Rows per multi-row INSERT; keeps each statement well below Postgres' bind parameter limit
+TRANSACTION_INSERT_BATCH_SIZE = int(os.environ.get('TRANSACTION_INSERT_BATCH_SIZE', '1000'))
+# Rows parsed, copied and committed together by /raw-records/import
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '5000'))
+
+# Header names (lowercased) recognised in uploaded CSV files
+CSV_DATE_COLUMNS = ('date', 'transaction date', 'transaction_date', 'posted date', 'posting date', 'value date')
+CSV_TEXT_COLUMNS = ('raw_text', 'text', 'description', 'details', 'narration', 'memo', 'note', 'notes')
+# Signed amount column (negative = money out), or separate money-out / money-in columns
+CSV_AMOUNT_COLUMNS = ('amount', 'value', 'transaction amount')
+CSV_DEBIT_COLUMNS = ('debit', 'debit amount', 'withdrawal', 'withdrawals', 'paid out', 'money out')
+CSV_CREDIT_COLUMNS = ('credit', 'credit amount', 'deposit', 'deposits', 'paid in', 'money in')
+
+# Optional leading date on plain-text import lines, e.g. "2024-01-05 bus 50"
+TEXT_LINE_DATE_RE = re.compile(r"^\s*(\d{4}-\d{2}-\d{2})[\s,;:-]+(.*)$")
+
+
+def _is_complete(tx):
+    return tx.get('amount') is not None and bool(tx.get('type')) and bool(tx.get('category')) and bool(tx.get('date'))
+
+
+def prepare_transactions(raw_text, date):
+    """Parse raw_text and return the transactions complete enough to store"""
+    lines = raw_text.strip().splitlines()
+    prepared = []
+    for tx in parse_lines(lines):
+        if not tx:
+            continue
+        tx['date'] = tx.get('date') or date
+        tx['type'] = (tx.get('type') or '').upper()
+
+        # Skip incomplete transactions
+        if not _is_complete(tx):
+            logger.info('Skipping incomplete transaction: %s', tx)
+            continue
+        prepared.append(tx)
+    return prepared
+
+
+def insert_raw_entry(user_id, date, raw_text):
+    """Insert a raw_entries row and return it"""
+    insert_raw_sql = text("""
+        INSERT INTO raw_entries (user_id, date, raw_text)
+        VALUES (:user_id, :date, :raw_text)
+        RETURNING *;
+    """)
+    result = db.session.execute(insert_raw_sql, {'user_id': user_id, 'date': date, 'raw_text': raw_text})
+    return result.fetchone()
+
+
+def insert_transactions(user_id, transactions):
+    """Insert a user's transactions with one multi-row INSERT ... RETURNING per batch"""
+    saved = []
+    for start in range(0, len(transactions), TRANSACTION_INSERT_BATCH_SIZE):
+        batch = transactions[start:start + TRANSACTION_INSERT_BATCH_SIZE]
+        values = []
+        params = {'user_id': user_id}
+        for i, tx in enumerate(batch):
+            values.append(f"(:user_id, :amount_{i}, :type_{i}, :category_{i}, :date_{i})")
+            params[f'amount_{i}'] = tx['amount']
+            params[f'type_{i}'] = tx['type']
+            params[f'category_{i}'] = tx['category']
+            params[f'date_{i}'] = tx['date']
+
+        insert_tx_sql = text(
+            "INSERT INTO transactions (user_id, amount, type, category, date) VALUES "
+            + ", ".join(values)
+            + " RETURNING *;"
+        )
+        saved.extend(db.session.execute(insert_tx_sql, params).fetchall())
+    return saved
+
 
 @raw_bp.route('/raw-records/create', methods=['POST'])
 def create_raw_record_flask():
@@ -18,60 +99,24 @@ def create_raw_record_flask():
     if not user_id or not date or not raw_text:
         return jsonify({'error': 'Missing required fields'}), 400
 
+    if RAW_RECORD_BUFFER_ENABLED:
+        return _create_buffered(user_id, date, raw_text)
+
     try:
-        # Insert raw_entries row and return it
-        insert_raw_sql = text("""
-            INSERT INTO raw_entries (user_id, date, raw_text)
-            VALUES (:user_id, :date, :raw_text)
-            RETURNING *;
-        """)
-
-        result = db.session.execute(insert_raw_sql, {'user_id': user_id, 'date': date, 'raw_text': raw_text})
-        raw_entry = result.fetchone()
-
-        # Parse lines
-        lines = raw_text.strip().splitlines()
-        parsed_transactions = []
-        for line in lines:
-            tx = parse_transaction(line.strip())
-            if tx:
-                tx['date'] = tx.get('date') or date
-                parsed_transactions.append(tx)
-
-        saved_transactions = []
-        insert_tx_sql = text("""
-            INSERT INTO transactions (user_id, amount, type, category, date)
-            VALUES (:user_id, :amount, :type, :category, :date)
-            RETURNING *;
-        """)
-
-        for tx in parsed_transactions:
-            amount = tx.get('amount')
-            tx_type = (tx.get('type') or '').upper()
-            category = tx.get('category')
-            tx_date = tx.get('date')
-
-            # Skip incomplete transactions
-            if amount is None or not tx_type or not category or not tx_date:
-                logger.info('Skipping incomplete transaction: %s', tx)
-                continue
+        raw_entry = insert_raw_entry(user_id, date, raw_text)
 
-            r = db.session.execute(insert_tx_sql, {
-                'user_id': user_id,
-                'amount': amount,
-                'type': tx_type,
-                'category': category,
-                'date': tx_date
-            })
-            saved_transactions.append(r.fetchone())
+        # Parse lines in one batch, then write them in one round trip
+        parsed_transactions = prepare_transactions(raw_text, date)
+        saved_transactions = insert_transactions(user_id, parsed_transactions)
+        apply_to_rollups(user_id, parsed_transactions)
 
         # commit once
         db.session.commit()
 
         return jsonify({
             'message': 'Raw record and transactions saved successfully',
-            'raw_entry': dict(raw_entry) if raw_entry else None,
-            'transactions': [dict(t) for t in saved_transactions]
+            'raw_entry': dict(raw_entry._mapping) if raw_entry else None,
+            'transactions': [dict(t._mapping) for t in saved_transactions]
         }), 201
 
     except Exception as e:
@@ -81,3 +126,218 @@ def create_raw_record_flask():
         except Exception:
             pass
         return jsonify({'error': 'Internal Server Error'}), 500
+
+
+def _create_buffered(user_id, date, raw_text):
+    """Parse in the request, then hand the writes to the group-commit buffer"""
+    try:
+        parsed_transactions = prepare_transactions(raw_text, date)
+        record = get_write_buffer(current_app._get_current_object()).submit(user_id, date, raw_text, parsed_transactions)
+    except BufferFullError as e:
+        return jsonify({'error': f'Ingestion buffer is full: {str(e)}'}), 503
+    except Exception:
+        logger.exception('Error in create_raw_record_flask')
+        return jsonify({'error': 'Internal Server Error'}), 500
+
+    if RAW_RECORD_BUFFER_DURABILITY == 'async':
+        return jsonify({
+            'message': 'Raw record accepted and queued for saving',
+            'transactions': parsed_transactions
+        }), 202
+
+    if not record.done.wait(RAW_RECORD_BUFFER_WAIT_SECONDS):
+        return jsonify({'error': 'Timed out waiting for the raw record to be saved'}), 504
+    if record.error:
+        return jsonify({'error': 'Internal Server Error'}), 500
+    return jsonify({
+        'message': 'Raw record and transactions saved successfully',
+        'raw_entry': record.raw_entry,
+        'transactions': record.saved_transactions
+    }), 201
+
+
+# ---- Bulk file import ----
+def _parse_date(value, date_format):
+    try:
+        return datetime.strptime(value.strip(), date_format).date().isoformat()
+    except (ValueError, AttributeError):
+        return None
+
+
+def _find_column(fieldnames, candidates):
+    lowered = {name.strip().lower(): name for name in fieldnames if name}
+    return next((lowered[c] for c in candidates if c in lowered), None)
+
+
+def _parse_amount(value):
+    """Signed float from a bank-export amount cell: '1,234.50', '-45.10', '(45.10)', '45.10 DR', '45.10 CR'"""
+    text = (value or '').strip().upper()
+    if not text:
+        return None
+    negative = text.startswith('-') or (text.startswith('(') and text.endswith(')')) or text.endswith('DR')
+    digits = re.sub(r"[^\d.]", "", text)
+    try:
+        amount = float(digits) if digits else None
+    except ValueError:
+        return None
+    if amount is None:
+        return None
+    return -amount if negative else amount
+
+
+def _csv_amount(row, amount_col, debit_col, credit_col):
+    """(amount, type) from the row's amount columns, or (None, None) to leave both to the parser"""
+    credit = _parse_amount(row.get(credit_col)) if credit_col else None
+    if credit:
+        return abs(credit), 'INCOME'
+    debit = _parse_amount(row.get(debit_col)) if debit_col else None
+    if debit:
+        return abs(debit), 'EXPENSE'
+    amount = _parse_amount(row.get(amount_col)) if amount_col else None
+    if amount:
+        # Most sheets list plain positive amounts; only a sign marker on the row says which way
+        # the money went, otherwise the type the parser found stands
+        marker = (row.get(amount_col) or '').strip().upper()
+        if amount < 0:
+            return abs(amount), 'EXPENSE'
+        if marker.startswith('+') or marker.endswith('CR'):
+            return amount, 'INCOME'
+        return amount, None
+    return None, None
+
+
+def _iter_csv_rows(stream, default_date, date_format):
+    """Yield (date, entry_text, amount, type) from a CSV export with a header row"""
+    reader = csv.DictReader(stream)
+    fieldnames = reader.fieldnames or []
+    date_col = _find_column(fieldnames, CSV_DATE_COLUMNS)
+    text_col = _find_column(fieldnames, CSV_TEXT_COLUMNS)
+    amount_col = _find_column(fieldnames, CSV_AMOUNT_COLUMNS)
+    debit_col = _find_column(fieldnames, CSV_DEBIT_COLUMNS)
+    credit_col = _find_column(fieldnames, CSV_CREDIT_COLUMNS)
+    if not text_col:
+        raise ValueError(f"CSV needs one of these columns: {', '.join(CSV_TEXT_COLUMNS)}")
+
+    for row in reader:
+        date_value = (row.get(date_col) or '').strip() if date_col else ''
+        # Only a missing date falls back to the form's; one that doesn't parse skips the row
+        date = _parse_date(date_value, date_format) if date_value else default_date
+        # The amount stays out of the text, so numbers in the description are not mistaken for it
+        amount, tx_type = _csv_amount(row, amount_col, debit_col, credit_col)
+        yield date, (row.get(text_col) or '').strip(), amount, tx_type
+
+
+def _iter_text_rows(stream, default_date):
+    """Yield (date, entry_text, None, None) from a plain-text file, one entry per line"""
+    for line in stream:
+        match = TEXT_LINE_DATE_RE.match(line)
+        if match:
+            yield _parse_date(match.group(1), '%Y-%m-%d'), match.group(2).strip(), None, None
+        else:
+            yield default_date, line.strip(), None, None
+
+
+def _copy_rows(cursor, table, columns, rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def _import_batch(user_id, batch):
+    """Parse one batch of (date, text, amount, type) rows and load it; returns the number of transactions stored"""
+    parsed = parse_lines([entry for _, entry, _, _ in batch])
+    transactions = []
+    raw_by_date = {}
+    for (date, entry, amount, tx_type), tx in zip(batch, parsed):
+        tx['date'] = date
+        # Amount and type from the file win; the parsed ones are only a fallback
+        if amount is not None:
+            tx['amount'] = amount
+        tx['type'] = (tx_type or tx.get('type') or '').upper()
+        if not _is_complete(tx):
+            continue
+        transactions.append(tx)
+        raw_by_date.setdefault(date, []).append(entry)
+
+    # One raw_entries row per imported day, like a day's paste in /raw-records/create
+    raw_rows = [(user_id, date, '\n'.join(entries)) for date, entries in raw_by_date.items()]
+    tx_rows = [(user_id, tx['amount'], tx['type'], tx['category'], tx['date']) for tx in transactions]
+
+    cursor = db.session.connection().connection.cursor()
+    try:
+        if hasattr(cursor, 'copy_expert'):
+            _copy_rows(cursor, 'raw_entries', ('user_id', 'date', 'raw_text'), raw_rows)
+            _copy_rows(cursor, 'transactions', ('user_id', 'amount', 'type', 'category', 'date'), tx_rows)
+        else:
+            # Drivers without COPY (e.g. SQLite in local runs) fall back to batched inserts
+            for row in raw_rows:
+                insert_raw_entry(*row)
+            insert_transactions(user_id, transactions)
+    finally:
+        cursor.close()
+    apply_to_rollups(user_id, transactions)
+    return len(transactions)
+
+
+@raw_bp.route('/raw-records/import', methods=['POST'])
+def import_raw_records():
+    """Bulk-load an uploaded CSV or plain-text file, committing once per batch"""
+    upload = request.files.get('file')
+    user_id = request.form.get('user_id')
+    default_date = request.form.get('date')
+    date_format = request.form.get('date_format', '%Y-%m-%d')
+
+    if not user_id or upload is None:
+        return jsonify({'error': 'Missing required fields'}), 400
+    if default_date and not _parse_date(default_date, '%Y-%m-%d'):
+        return jsonify({'error': 'date must be YYYY-MM-DD'}), 400
+
+    file_format = (request.form.get('format') or '').lower()
+    if not file_format:
+        is_csv = (upload.filename or '').lower().endswith('.csv') or upload.mimetype in ('text/csv', 'application/vnd.ms-excel')
+        file_format = 'csv' if is_csv else 'text'
+
+    start = time.time()
+    summary = {'rows_read': 0, 'accepted': 0, 'skipped': 0, 'batches': 0}
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        if file_format == 'csv':
+            rows = _iter_csv_rows(stream, default_date, date_format)
+        else:
+            rows = _iter_text_rows(stream, default_date)
+
+        def flush(batch):
+            stored = _import_batch(user_id, batch)
+            db.session.commit()
+            summary['accepted'] += stored
+            summary['skipped'] += len(batch) - stored
+            summary['batches'] += 1
+
+        batch = []
+        for date, entry, amount, tx_type in rows:
+            summary['rows_read'] += 1
+            if not entry or not date:
+                summary['skipped'] += 1
+                continue
+            batch.append((date, entry, amount, tx_type))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+        summary['duration_seconds'] = round(time.time() - start, 3)
+        logger.info('import_raw_records: %s', summary)
+        return jsonify({'message': 'Import finished', **summary}), 201
+
+    except ValueError as e:
+        return jsonify({'error': str(e), **summary}), 400
+    except Exception:
+        logger.exception('Error in import_raw_records after %d rows', summary['rows_read'])
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+        # Earlier batches are already committed; report how far we got
+        return jsonify({'error': 'Internal Server Error', **summary}), 500
@@ -1,10 +1,115 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from werkzeug.utils import secure_filename
 from .. import db
+from ..database import execute_read, read_engine
+from .conditional import is_not_modified, make_etag, not_modified_response, set_validators
 from sqlalchemy import text
+from datetime import date, datetime
+import base64
+import csv
+import io
+import itertools
+import json
+import os
+import uuid
 
 # Create the blueprint
 transactions_bp = Blueprint('transactions', __name__)
 
+# Page size when ?limit is not given, and the largest page a client may ask for
+TRANSACTIONS_PAGE_SIZE = int(os.environ.get('TRANSACTIONS_PAGE_SIZE', '100'))
+TRANSACTIONS_MAX_PAGE_SIZE = int(os.environ.get('TRANSACTIONS_MAX_PAGE_SIZE', '1000'))
+# Rows fetched from the server-side cursor per round trip when streaming
+TRANSACTIONS_STREAM_CHUNK_SIZE = int(os.environ.get('TRANSACTIONS_STREAM_CHUNK_SIZE', '1000'))
+
+# Rows per fetch from the export's server-side cursor
+TRANSACTIONS_EXPORT_FETCH_SIZE = int(os.environ.get('TRANSACTIONS_EXPORT_FETCH_SIZE', '2000'))
+
+TRANSACTION_COLUMNS = 'transaction_id, user_id, amount, date, type, created_at, category'
+EXPORT_CSV_HEADER = ('id', 'user_id', 'amount', 'type', 'category', 'date', 'created_at')
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Same fields and values as _transaction_dict, encoded by Postgres (a zero amount is null there too)
+TRANSACTION_JSON = """
+    json_build_object(
+        'id', transaction_id, 'user_id', user_id, 'amount', NULLIF(amount, 0)::float8,
+        'type', type, 'category', category, 'date', date,
+        -- isoformat(): microseconds always six digits, left out when zero
+        'created_at', to_char(created_at, CASE WHEN date_trunc('second', created_at) = created_at
+                                               THEN 'YYYY-MM-DD"T"HH24:MI:SS'
+                                               ELSE 'YYYY-MM-DD"T"HH24:MI:SS.US' END)
+    )
+"""
+TRANSACTION_JSON_COLUMN = f"transaction_id, created_at, {TRANSACTION_JSON}::text AS row_json"
+
+
+def encode_cursor(created_at, transaction_id):
+    """Opaque keyset cursor for the row a page ended on"""
+    payload = json.dumps([created_at.isoformat(), transaction_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    created_at, transaction_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    return datetime.fromisoformat(created_at), transaction_id
+
+
+def parse_transaction_filters(args):
+    """Build SQL conditions and params from the optional from/to/category/type query args"""
+    conditions = ['user_id = :user_id']
+    params = {}
+    if args.get('from'):
+        conditions.append('date >= :date_from')
+        params['date_from'] = date.fromisoformat(args['from'])
+    if args.get('to'):
+        conditions.append('date <= :date_to')
+        params['date_to'] = date.fromisoformat(args['to'])
+    if args.get('category'):
+        conditions.append('category = :category')
+        params['category'] = args['category']
+    if args.get('type'):
+        # Older rows were stored lowercase, newer ones uppercase
+        conditions.append('lower(type) = :type')
+        params['type'] = args['type'].lower()
+    return conditions, params
+
+
+def _transaction_dict(row):
+    return {
+        'id': row.transaction_id,
+        'user_id': row.user_id,
+        'amount': float(row.amount) if row.amount else None,
+        'type': row.type,
+        'category': row.category,
+        'date': row.date.isoformat() if row.date else None,
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    }
+
+
+def _stream_transactions(result, partitions, first_partition, user_id, limit):
+    """Yield the response JSON in chunks from rows Postgres has already encoded"""
+    try:
+        yield '{"userId": %s, "transactions": [' % json.dumps(user_id)
+        count = 0
+        last = None
+        next_cursor = None
+        for partition in itertools.chain([first_partition], partitions):
+            chunk = []
+            for row in partition:
+                if limit is not None and count == limit:
+                    # The extra row only tells us another page exists
+                    next_cursor = encode_cursor(last.created_at, last.transaction_id)
+                    break
+                chunk.append(row.row_json)
+                count += 1
+                last = row
+            if chunk:
+                yield (',' if count > len(chunk) else '') + ','.join(chunk)
+        yield '], "count": %d, "next_cursor": %s}' % (count, json.dumps(next_cursor))
+    finally:
+        result.close()
+
+
 @transactions_bp.route('/transactions/<user_id>', methods=['GET'])
 def get_transactions(user_id):
 
@@ -12,37 +117,182 @@ def get_transactions(user_id):
         # Validate user_id
         if not user_id:
             return jsonify({'error': 'userId is required'}), 400
-        
-        # Query to get the transactions for the user
-        query = text("""
-            SELECT transaction_id, user_id, amount, date, type, created_at, category
-            FROM transactions 
-            WHERE user_id = :user_id 
-            ORDER BY created_at DESC
+
+        # Paging and filter arguments; limit=all returns every matching row in one streamed response
+        try:
+            limit = request.args.get('limit', TRANSACTIONS_PAGE_SIZE)
+            if limit == 'all':
+                limit = None
+            else:
+                limit = int(limit)
+                if limit < 1:
+                    raise ValueError
+                limit = min(limit, TRANSACTIONS_MAX_PAGE_SIZE)
+            conditions, params = parse_transaction_filters(request.args)
+            if request.args.get('cursor'):
+                params['cursor_created_at'], params['cursor_id'] = decode_cursor(request.args['cursor'])
+                conditions.append('(created_at, transaction_id) < (:cursor_created_at, :cursor_id)')
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid limit, cursor or filter value'}), 400
+
+        # Cheap validator: any insert or delete for the user changes the count or latest created_at
+        version = execute_read(text("""
+            SELECT count(*) AS row_count, max(created_at) AS last_created
+            FROM transactions
+            WHERE user_id = :user_id
+        """), {'user_id': user_id}).fetchone()
+        etag = make_etag(user_id, version.row_count, version.last_created, request.query_string.decode())
+        if is_not_modified(etag, version.last_created):
+            return not_modified_response(etag, version.last_created)
+
+        # Postgres encodes each row itself; other databases get the per-row Python path
+        stream = read_engine().dialect.name == 'postgresql'
+        columns = TRANSACTION_JSON_COLUMN if stream else TRANSACTION_COLUMNS
+
+        # Keyset query: fetch one extra row to know whether another page exists
+        query = text(f"""
+            SELECT {columns}
+            FROM transactions
+            WHERE {' AND '.join(conditions)}
+            ORDER BY created_at DESC, transaction_id DESC
+            {'LIMIT :limit' if limit is not None else ''}
         """)
+        params['user_id'] = user_id
+        if limit is not None:
+            params['limit'] = limit + 1
+
+        if stream:
+            # Flat memory for any page size: rows go out as the server-side cursor yields them.
+            # The query runs (and its first rows arrive) before the response starts, so a
+            # database error still gets the 500 below instead of a truncated 200.
+            result = execute_read(
+                query.execution_options(stream_results=True, yield_per=TRANSACTIONS_STREAM_CHUNK_SIZE), params
+            )
+            try:
+                partitions = result.partitions()
+                first_partition = next(partitions, [])
+            except Exception:
+                result.close()
+                raise
+            response = Response(
+                stream_with_context(_stream_transactions(result, partitions, first_partition, user_id, limit)),
+                mimetype='application/json',
+            )
+            # The generator's finally only runs once it has started; this covers a client gone before that
+            response.call_on_close(result.close)
+            return set_validators(response, etag, version.last_created), 200
+
+        # Read-only: served by the replica when DATABASE_READ_URL is set
+        rows = execute_read(query, params).fetchall()
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit]
+        transactions = [_transaction_dict(row) for row in rows]
 
-        # Execute the query with the user_id parameter
-        result = db.session.execute(query, {'user_id': user_id})
-        transactions = []
-        
-        # Process the result set and structure the response
-        for row in result:
-            transaction = {
-                'id': row.transaction_id,  
-                'user_id': row.user_id,
-                'amount': float(row.amount) if row.amount else None,
-                'type': row.type,
-                'category': row.category,
-                'date': row.date.isoformat() if row.date else None,
-                'created_at': row.created_at.isoformat() if row.created_at else None
-            }
-            transactions.append(transaction)
-        
-        return jsonify({
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].transaction_id) if has_more else None
+
+        response = jsonify({
             'userId': user_id,
             'transactions': transactions,
-            'count': len(transactions)
-        }), 200
-        
+            'count': len(transactions),
+            'next_cursor': next_cursor
+        })
+        return set_validators(response, etag, version.last_created), 200
+
+    except Exception as e:
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+
+def _iter_export_rows(query_sql, params):
+    """Yield lists of rows from a named (server-side) cursor, TRANSACTIONS_EXPORT_FETCH_SIZE at a time"""
+    connection = db.session.connection(bind_arguments={'bind': read_engine()})
+    if connection.dialect.driver != 'psycopg2':
+        # Other drivers: let SQLAlchemy stream (or buffer) the result
+        result = connection.execute(
+            text(query_sql).execution_options(stream_results=True, yield_per=TRANSACTIONS_EXPORT_FETCH_SIZE), params
+        )
+        try:
+            for partition in result.partitions():
+                yield [tuple(row) for row in partition]
+        finally:
+            result.close()
+        return
+
+    # Named cursors only accept DBAPI-style parameters
+    compiled = text(query_sql).bindparams(**params).compile(dialect=connection.dialect)
+    cursor = connection.connection.cursor(name=f'export_{uuid.uuid4().hex}')
+    try:
+        cursor.itersize = TRANSACTIONS_EXPORT_FETCH_SIZE
+        cursor.execute(str(compiled), compiled.params)
+        while True:
+            rows = cursor.fetchmany(TRANSACTIONS_EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def _iso(value):
+    # Drivers without date types (SQLite) hand back strings already
+    return value.isoformat() if hasattr(value, 'isoformat') else (value or '')
+
+
+def _export_csv(query_sql, params):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    # Header goes out before the query runs, so the download starts at once
+    writer.writerow(EXPORT_CSV_HEADER)
+    yield buf.getvalue()
+    for rows in _iter_export_rows(query_sql, params):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(
+            (tx_id, user_id, amount, tx_type, category, _iso(tx_date), _iso(created_at))
+            for tx_id, user_id, amount, tx_date, tx_type, created_at, category in rows
+        )
+        yield buf.getvalue()
+
+
+def _export_ndjson(query_sql, params):
+    for rows in _iter_export_rows(query_sql, params):
+        yield ''.join(f'{row[0]}\n' for row in rows)
+
+
+@transactions_bp.route('/transactions/<user_id>/export', methods=['GET'])
+def export_transactions(user_id):
+    """Stream a user's full transaction history (oldest first) as CSV or NDJSON"""
+    try:
+        export_format = (request.args.get('format') or '').lower()
+        if not export_format:
+            wants_ndjson = request.accept_mimetypes.best_match(['text/csv', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+            export_format = 'ndjson' if wants_ndjson else 'csv'
+        if export_format not in ('csv', 'ndjson'):
+            return jsonify({'error': 'format must be csv or ndjson'}), 400
+
+        try:
+            conditions, params = parse_transaction_filters(request.args)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid filter value'}), 400
+        params['user_id'] = user_id
+
+        if export_format == 'csv':
+            columns, generate, mimetype = TRANSACTION_COLUMNS, _export_csv, 'text/csv'
+        else:
+            # NDJSON lines are encoded by Postgres, like the /transactions listing
+            if read_engine().dialect.name != 'postgresql':
+                return jsonify({'error': 'NDJSON export needs PostgreSQL'}), 400
+            columns, generate, mimetype = f"{TRANSACTION_JSON}::text AS row_json", _export_ndjson, NDJSON_MIMETYPE
+
+        query_sql = f"""
+            SELECT {columns}
+            FROM transactions
+            WHERE {' AND '.join(conditions)}
+            ORDER BY created_at, transaction_id
+        """
+        response = Response(stream_with_context(generate(query_sql, params)), mimetype=mimetype)
+        filename = f"transactions-{secure_filename(user_id) or 'export'}.{export_format}"
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response, 200
+
     except Exception as e:
         return jsonify({'error': f'Database error: {str(e)}'}), 500
@@ -0,0 +1,56 @@
+import os
+
+from flask import current_app
+
+from . import db
+
+# Optional read replica; read-only queries go there when it is set
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL')
+READ_BIND = 'replica'
+
+# Engine options read from the environment; unset values keep SQLAlchemy's defaults
+_INT_OPTIONS = {
+    'DB_POOL_SIZE': 'pool_size',
+    'DB_MAX_OVERFLOW': 'max_overflow',
+    'DB_POOL_RECYCLE': 'pool_recycle',
+    'DB_POOL_TIMEOUT': 'pool_timeout',
+    'DB_QUERY_CACHE_SIZE': 'query_cache_size',
+}
+
+
+def engine_options_from_env():
+    """SQLALCHEMY_ENGINE_OPTIONS for every engine (primary and replica)"""
+    options = {
+        # Check connections on checkout so a failover or idle timeout costs a reconnect, not a 500
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+    }
+    for env_name, option in _INT_OPTIONS.items():
+        value = os.environ.get(env_name)
+        if value:
+            options[option] = int(value)
+    return options
+
+
+def configure_database(app):
+    options = engine_options_from_env()
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    if DATABASE_READ_URL:
+        # Bind options are not inherited from SQLALCHEMY_ENGINE_OPTIONS
+        app.config['SQLALCHEMY_BINDS'] = {READ_BIND: {'url': DATABASE_READ_URL, **options}}
+
+
+def read_engine():
+    """Engine for read-only queries: the replica when configured, else the primary"""
+    if READ_BIND in current_app.config.get('SQLALCHEMY_BINDS', {}):
+        return db.engines[READ_BIND]
+    return db.engine
+
+
+def execute_read(statement, params=None):
+    """db.session.execute for read-only statements, routed to the read replica when there is one.
+
+    Replicas lag the primary, so reads that must see a write just made (or that feed a
+    cache invalidated by that write) should keep using db.session.execute.
+    """
+    return db.session.execute(statement, params, bind_arguments={'bind': read_engine()})
@@ -0,0 +1,138 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Worker processes and users per chunk for `manage.py generate-insights`
+INSIGHT_BATCH_WORKERS = int(os.environ.get('INSIGHT_BATCH_WORKERS', str(os.cpu_count() or 2)))
+INSIGHT_BATCH_CHUNK_SIZE = int(os.environ.get('INSIGHT_BATCH_CHUNK_SIZE', '50'))
+
+_app_context = None
+
+
+def _init_worker():
+    """Give each worker process its own app, app context and DB engine"""
+    global _app_context
+    from .. import create_app
+
+    _app_context = create_app().app_context()
+    _app_context.push()
+
+
+def generate_chunk(user_ids):
+    """Generate insights for a chunk of users and store the new ones with one INSERT"""
+    from .. import db
+    from .generate_insights import (find_reusable_insight, get_stats, insight_payload, insight_title,
+                                    stats_fingerprint, store_insights)
+    from .insights_chain import get_insight_backend
+
+    result = {'completed': [], 'generated': 0, 'reused': 0, 'failed': 0, 'latencies': []}
+    rows = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        try:
+            stats = get_stats(user_id)
+            if isinstance(stats, str):
+                raise RuntimeError(stats)
+            stats_hash = stats_fingerprint(insight_payload(stats))
+            if find_reusable_insight(user_id, stats_hash) is not None:
+                result['reused'] += 1
+            else:
+                content = get_insight_backend().generate(stats)
+                if getattr(content, 'degraded', False):
+                    stats_hash = None
+                rows.append((user_id, insight_title(), str(content), stats_hash))
+        except Exception as e:
+            logger.warning('Insight generation failed for user %s: %s', user_id, e)
+            db.session.rollback()
+            result['failed'] += 1
+        else:
+            result['completed'].append(user_id)
+        result['latencies'].append(time.perf_counter() - start)
+
+    # Reads above leave a transaction open; the batched insert commits it
+    result['generated'] = store_insights(rows)
+    db.session.commit()
+    return result
+
+
+def _chunks(user_ids, chunk_size, skip):
+    chunk = []
+    for user_id in user_ids:
+        if user_id in skip:
+            continue
+        chunk.append(user_id)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load_checkpoint(path):
+    """User ids already finished by an earlier run"""
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_insight_batch(user_ids, workers=INSIGHT_BATCH_WORKERS, chunk_size=INSIGHT_BATCH_CHUNK_SIZE,
+                      checkpoint=None, on_progress=None):
+    """Fan user ids out to a process pool in chunks; completed users are appended to the checkpoint file.
+
+    The checkpoint only outlives an interrupted run or one with failures (a rerun then retries
+    just those users); a run that finishes cleanly removes it so the next run starts over.
+    """
+    done = load_checkpoint(checkpoint)
+    summary = {'users': 0, 'generated': 0, 'reused': 0, 'failed': 0, 'skipped': len(done), 'latencies': []}
+    start = time.perf_counter()
+    chunks = _chunks(user_ids, chunk_size, done)
+    checkpoint_file = open(checkpoint, 'a') if checkpoint else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker) as executor:
+            # Keep a couple of chunks per worker in flight instead of queueing every user up front
+            pending = set()
+            for chunk in chunks:
+                pending.add(executor.submit(generate_chunk, chunk))
+                if len(pending) < workers * 2:
+                    continue
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _collect(finished, summary, checkpoint_file, start, on_progress)
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _collect(finished, summary, checkpoint_file, start, on_progress)
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+    if checkpoint and not summary['failed'] and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    summary['duration_seconds'] = time.perf_counter() - start
+    return summary
+
+
+def _collect(futures, summary, checkpoint_file, start, on_progress):
+    for future in futures:
+        result = future.result()
+        summary['users'] += len(result['completed']) + result['failed']
+        for key in ('generated', 'reused', 'failed'):
+            summary[key] += result[key]
+        summary['latencies'].extend(result['latencies'])
+        if checkpoint_file:
+            # Failed users stay out of the checkpoint so a resumed run retries them
+            checkpoint_file.write(''.join(f'{user_id}\n' for user_id in result['completed']))
+            checkpoint_file.flush()
+        if on_progress:
+            on_progress(summary, time.perf_counter() - start)
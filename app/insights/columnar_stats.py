@@ -0,0 +1,101 @@
+import numpy as np
+
+
+def _factorize(values):
+    """Integer codes for values plus the list of distinct values, in first-seen order"""
+    index = {}
+    codes = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int32, count=len(values))
+    return codes, list(index)
+
+
+class TransactionColumns:
+    """Transactions as parallel arrays: float amounts, datetime64 dates, integer-coded categories and types"""
+
+    def __init__(self, amounts, dates, category_codes, categories, type_codes, types):
+        self.amounts = amounts
+        self.dates = dates
+        self.category_codes = category_codes
+        self.categories = categories
+        self.type_codes = type_codes
+        self.types = types
+
+    def __len__(self):
+        return len(self.amounts)
+
+    @classmethod
+    def from_columns(cls, amounts, dates, categories, types):
+        """Build from plain sequences (amount, date, category, type), e.g. straight from a query"""
+        amounts = np.array([a if a is not None else 0.0 for a in amounts], dtype=np.float64)
+        # ISO strings may carry a time part; dates only need the day
+        dates = np.array([d[:10] if isinstance(d, str) else d for d in dates], dtype='datetime64[D]')
+        category_codes, category_values = _factorize(categories)
+        type_codes, type_values = _factorize(types)
+        return cls(amounts, dates, category_codes, category_values, type_codes, type_values)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from the per-row dicts returned by get_transactions"""
+        return cls.from_columns(
+            [tx.get('amount', 0) for tx in rows],
+            [tx.get('date') for tx in rows],
+            [tx.get('category', 'other') for tx in rows],
+            [tx.get('type', 'expense') for tx in rows],
+        )
+
+
+def _week_thursdays(days):
+    """Day number of the Thursday in each day's ISO week (days since 1970-01-01)"""
+    # 1970-01-01 was a Thursday; weekday 0 = Monday
+    weekday = (days + 3) % 7
+    return days - weekday + 3
+
+
+def iso_week_labels(thursdays):
+    """'YYYY-Www' for each ISO-week Thursday; the ISO year is the year its Thursday falls in"""
+    iso_year = thursdays.astype('datetime64[D]').astype('datetime64[Y]')
+    jan1 = iso_year.astype('datetime64[D]').astype(np.int64)
+    week = (thursdays - jan1) // 7 + 1
+    years = iso_year.astype(np.int64) + 1970
+    return [f"{y}-W{w:02d}" for y, w in zip(years.tolist(), week.tolist())]
+
+
+def _group_sum(keys, amounts, step=1):
+    """Sum amounts per integer key with a dense bincount over the key range (no sorting)"""
+    if len(keys) == 0:
+        return keys, amounts
+    offset = keys.min()
+    slots = (keys - offset) // step
+    sums = np.bincount(slots, weights=amounts)
+    present = np.bincount(slots) > 0
+    return np.flatnonzero(present) * step + offset, sums[present]
+
+
+def calculate_stats_columnar(transactions):
+    """Vectorized calculate_stats over TransactionColumns (or get_transactions' dict)"""
+    if isinstance(transactions, dict):
+        if not transactions or 'transactions' not in transactions:
+            return "No transactions found"
+        transactions = TransactionColumns.from_rows(transactions['transactions'])
+
+    amounts = transactions.amounts
+    # Stored types are upper case ('INCOME'), parsed ones lower case
+    income_codes = [i for i, t in enumerate(transactions.types) if (t or '').lower() == 'income']
+    income_count = int(np.count_nonzero(np.isin(transactions.type_codes, income_codes)))
+
+    category_sums = np.bincount(transactions.category_codes, weights=amounts, minlength=len(transactions.categories))
+
+    # Undated transactions (NaT) count towards the totals but belong to no week or month
+    dated = ~np.isnat(transactions.dates)
+    dates = transactions.dates[dated]
+    dated_amounts = amounts[dated]
+    weeks, week_sums = _group_sum(_week_thursdays(dates.astype(np.int64)), dated_amounts, step=7)
+    months, month_sums = _group_sum(dates.astype('datetime64[M]').astype(np.int64), dated_amounts)
+
+    return {
+        'total_amount': float(amounts.sum()),
+        'income_count': income_count,
+        'expense_count': len(transactions) - income_count,
+        'categories': dict(zip(transactions.categories, category_sums.tolist())),
+        'weekly_totals': dict(zip(iso_week_labels(weeks), week_sums.tolist())),
+        'monthly_totals': dict(zip(np.datetime_as_string(months.astype('datetime64[M]')).tolist(), month_sums.tolist())),
+    }
@@ -1,16 +1,37 @@
 from .. import db
+from ..api.transactions import TRANSACTION_JSON
+from ..cache import create_cache
+from ..database import execute_read
+from ..metrics import register_metrics
 from sqlalchemy import text
-from .insights_chain import insight_chain  # Import the LangChain pipeline
+from .insights_chain import get_insight_backend  # Rule-based or LLM insight backend
+from .rollups import ROLLUPS_READ, ROLLUP_STATS_SQL
+import hashlib
 import json
-from datetime import datetime
+import os
+from datetime import datetime, timedelta
 
+# Regenerate an insight once the stored one is this old, even if the stats
+# are unchanged (0 = reuse it for as long as the stats match)
+INSIGHTS_MAX_AGE_SECONDS = int(os.environ.get('INSIGHTS_MAX_AGE_SECONDS', '0'))
 
-def store_insight(user_id, title, content):
+# Read-through cache for get_latest_insight, keyed by user_id and dropped by store_insight.
+# The TTL bounds staleness for writes made by other processes (other workers, the batch CLI).
+LATEST_INSIGHT_CACHE_BACKEND = os.environ.get('LATEST_INSIGHT_CACHE_BACKEND', 'memory').lower()
+LATEST_INSIGHT_CACHE_SIZE = int(os.environ.get('LATEST_INSIGHT_CACHE_SIZE', '10000'))
+LATEST_INSIGHT_CACHE_TTL_SECONDS = float(os.environ.get('LATEST_INSIGHT_CACHE_TTL_SECONDS', '300'))
+latest_insight_cache = create_cache(LATEST_INSIGHT_CACHE_BACKEND, LATEST_INSIGHT_CACHE_SIZE,
+                                    LATEST_INSIGHT_CACHE_TTL_SECONDS)
+register_metrics('latest_insight_cache', latest_insight_cache.stats)
+_MISSING = object()
+
+
+def store_insight(user_id, title, content, stats_hash=None):
     """Store generated insight in the insights table"""
     try:
         query = text("""
-            INSERT INTO insights (user_id, title, content, created_at)
-            VALUES (:user_id, :title, :content, :created_at)
+            INSERT INTO insights (user_id, title, content, created_at, stats_hash)
+            VALUES (:user_id, :title, :content, :created_at, :stats_hash)
             RETURNING insight_id
         """)
         
@@ -18,11 +39,13 @@ def store_insight(user_id, title, content):
             'user_id': user_id,
             'title': title,
             'content': content,
-            'created_at': datetime.utcnow()
+            'created_at': datetime.utcnow(),
+            'stats_hash': stats_hash
         })
         
         insight_id = result.fetchone()[0]
         db.session.commit()
+        latest_insight_cache.delete(str(user_id))
         
         return insight_id
     except Exception as e:
@@ -30,8 +53,43 @@ def store_insight(user_id, title, content):
         return f"Error storing insight: {str(e)}"
 
 
+def store_insights(rows):
+    """Insert many (user_id, title, content, stats_hash) rows with one multi-row INSERT and commit"""
+    if not rows:
+        return 0
+    values = []
+    params = {'created_at': datetime.utcnow()}
+    for i, (user_id, title, content, stats_hash) in enumerate(rows):
+        values.append(f"(:user_id_{i}, :title_{i}, :content_{i}, :created_at, :stats_hash_{i})")
+        params.update({f'user_id_{i}': user_id, f'title_{i}': title,
+                       f'content_{i}': content, f'stats_hash_{i}': stats_hash})
+    query = text(
+        "INSERT INTO insights (user_id, title, content, created_at, stats_hash) VALUES "
+        + ", ".join(values)
+    )
+    db.session.execute(query, params)
+    db.session.commit()
+    for user_id, _, _, _ in rows:
+        latest_insight_cache.delete(str(user_id))
+    return len(rows)
+
+
 def get_latest_insight(user_id):
-    """Get the latest insight for a user"""
+    """Get the latest insight for a user, from the cache when possible"""
+    key = str(user_id)
+    cached = latest_insight_cache.get(key, _MISSING)
+    if cached is not _MISSING:
+        return dict(cached) if cached else None
+
+    insight = _fetch_latest_insight(user_id)
+    # "No insight yet" is cached too; errors are not
+    if not isinstance(insight, str):
+        latest_insight_cache.set(key, insight)
+        return dict(insight) if insight else None
+    return insight
+
+
+def _fetch_latest_insight(user_id):
     try:
         query = text("""
             SELECT insight_id, user_id, title, content, created_at
@@ -58,34 +116,60 @@ def get_latest_insight(user_id):
         return f"Error fetching latest insight: {str(e)}"
 
 
+def insight_payload(stats):
+    """The stats as they are fingerprinted (and rendered into the prompt)"""
+    return {
+        "total_amount": stats['total_amount'],
+        "income_count": stats['income_count'],
+        "expense_count": stats['expense_count'],
+        "categories": json.dumps(stats['categories']),
+        "weekly_totals": json.dumps(stats['weekly_totals']),
+        "monthly_totals": json.dumps(stats['monthly_totals']),
+    }
+
+
+def insight_title():
+    return f"Financial Analysis - {datetime.utcnow().strftime('%Y-%m-%d')}"
+
+
+def stats_fingerprint(payload):
+    """Stable hash of the stats payload an insight is generated from"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def find_reusable_insight(user_id, stats_hash):
+    """Content of the latest insight if it was generated from identical stats (and is fresh enough)"""
+    query = text("""
+        SELECT content, stats_hash, created_at
+        FROM insights
+        WHERE user_id = :user_id
+        ORDER BY created_at DESC
+        LIMIT 1
+    """)
+    row = db.session.execute(query, {'user_id': user_id}).fetchone()
+    if not row or row.stats_hash != stats_hash:
+        return None
+    if INSIGHTS_MAX_AGE_SECONDS and row.created_at:
+        if datetime.utcnow() - row.created_at > timedelta(seconds=INSIGHTS_MAX_AGE_SECONDS):
+            return None
+    return row.content
+
+
 def get_transactions(user_id):
 
     if not user_id:
         return "No userId provided"
 
     try:
-        # Query using the actual column structure
-        query = text("""
-            SELECT transaction_id, user_id, amount, date, type, created_at, category
-            FROM transactions 
-            WHERE user_id = :user_id 
-            ORDER BY created_at DESC
+        # Postgres builds the whole list (same fields as the /transactions route) in one value
+        query = text(f"""
+            SELECT COALESCE(json_agg({TRANSACTION_JSON} ORDER BY created_at DESC, transaction_id DESC), '[]')
+            FROM transactions
+            WHERE user_id = :user_id
         """)
-        
-        result = db.session.execute(query, {'user_id': user_id})
-        transactions = []
-        
-        for row in result:
-            transaction = {
-                'id': row.transaction_id,
-                'user_id': row.user_id,
-                'amount': float(row.amount) if row.amount else None,
-                'type': row.type,
-                'category': row.category,
-                'date': row.date.isoformat() if row.date else None,
-                'created_at': row.created_at.isoformat() if row.created_at else None
-            }
-            transactions.append(transaction)
+
+        transactions = execute_read(query, {'user_id': user_id}).scalar()
         
         return {
             'userId': user_id,
@@ -117,7 +201,8 @@ def calculate_stats(transactions):
         total_amount += amount
 
         # Count income and expenses
-        if tx_type == 'income':
+        # Stored types are upper case ('INCOME'), parsed ones lower case
+        if (tx_type or '').lower() == 'income':
             income_count += 1
         else:
             expense_count += 1
@@ -127,8 +212,9 @@ def calculate_stats(transactions):
             categories[category] = 0
         categories[category] += amount
 
-        # Weekly totals
-        week = date[:10]
+        # Weekly totals, keyed by ISO week ("YYYY-Www") like get_stats
+        year, week_number, _ = datetime.fromisoformat(date[:10]).isocalendar()
+        week = f"{year}-W{week_number:02d}"
         if week not in weekly_totals:
             weekly_totals[week] = 0
         weekly_totals[week] += amount
@@ -147,39 +233,97 @@ def calculate_stats(transactions):
     }
 
 
-def generate_insights(user_id):
-    # Step 1: Get transaction data
-    transactions = get_transactions(user_id)
-    if isinstance(transactions, str):  
-        return transactions  # Return error message if fetch failed
+# One scan, one round trip: each grouping set yields one family of totals
+TRANSACTION_STATS_SQL = """
+    SELECT
+        GROUPING(category) AS by_category,
+        GROUPING(week) AS by_week,
+        GROUPING(month) AS by_month,
+        category, week, month,
+        SUM(amount) AS total,
+        COUNT(*) FILTER (WHERE lower(type) = 'income') AS income_count,
+        COUNT(*) AS tx_count
+    FROM (
+        SELECT amount, type, category,
+               to_char(date, 'IYYY-"W"IW') AS week,
+               to_char(date_trunc('month', date), 'YYYY-MM') AS month
+        FROM transactions
+        WHERE user_id = :user_id
+    ) t
+    GROUP BY GROUPING SETS ((), (category), (week), (month))
+    ORDER BY category, week, month
+"""
 
-    # Step 2: Calculate stats from the data
-    stats = calculate_stats(transactions)
+
+def get_stats(user_id):
+    """Same totals as calculate_stats, aggregated in Postgres (from the rollups when enabled)"""
+    if not user_id:
+        return "No userId provided"
+
+    try:
+        query = text(ROLLUP_STATS_SQL if ROLLUPS_READ else TRANSACTION_STATS_SQL)
+        result = execute_read(query, {'user_id': user_id})
+        stats = {
+            'total_amount': 0,
+            'income_count': 0,
+            'expense_count': 0,
+            'categories': {},
+            'weekly_totals': {},
+            'monthly_totals': {}
+        }
+
+        for row in result:
+            total = float(row.total) if row.total is not None else 0
+            if not row.by_category:
+                stats['categories'][row.category] = total
+            elif not row.by_week:
+                # Undated transactions count towards the totals but belong to no week
+                if row.week is not None:
+                    stats['weekly_totals'][row.week] = total
+            elif not row.by_month:
+                if row.month is not None:
+                    stats['monthly_totals'][row.month] = total
+            else:
+                stats['total_amount'] = total
+                stats['income_count'] = row.income_count
+                stats['expense_count'] = row.tx_count - row.income_count
+
+        return stats
+    except Exception as e:
+        return f"Error calculating stats: {str(e)}"
+
+
+def generate_insights(user_id):
+    # Step 1 + 2: Aggregate the user's transactions in the database
+    stats = get_stats(user_id)
     if isinstance(stats, str): 
         return stats  # Return error message if calculation failed
 
-    # Step 3: Generate natural language insights using LangChain
+    # Step 3: Generate natural language insights
     try:
-        response = insight_chain.invoke({
-            "total_amount": stats['total_amount'],
-            "income_count": stats['income_count'],
-            "expense_count": stats['expense_count'],
-            "categories": json.dumps(stats['categories']),
-            "weekly_totals": json.dumps(stats['weekly_totals']),
-            "monthly_totals": json.dumps(stats['monthly_totals']),
-        })
+        # Unchanged data since the last insight: reuse it instead of calling the LLM
+        stats_hash = stats_fingerprint(insight_payload(stats))
+        cached_content = find_reusable_insight(user_id, stats_hash)
+        if cached_content is not None:
+            return cached_content
+
+        # The backend takes the stats as-is; only LLM backends render a prompt
+        content = get_insight_backend().generate(stats)
         
         # Generate a title for the insight
-        title = f"Financial Analysis - {datetime.utcnow().strftime('%Y-%m-%d')}"
+        title = insight_title()
         
-        # Store the insight in the database
-        insight_id = store_insight(user_id, title, response.content)
+        # Store the insight in the database; a fallback answer is not kept for reuse,
+        # so the LLM is asked again once it recovers
+        if getattr(content, 'degraded', False):
+            stats_hash = None
+        insight_id = store_insight(user_id, title, content, stats_hash)
         
         if isinstance(insight_id, str) and insight_id.startswith("Error"):
             # If storage failed, still return the insight content
             print(f"Warning: {insight_id}")
         
-        # Return the LLM's generated content
-        return response.content  # or response['content'] if using older LangChain
+        # Return the generated content
+        return content
     except Exception as e:
         return f"Error generating insights: {str(e)}"
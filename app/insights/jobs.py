@@ -0,0 +1,301 @@
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from ..metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# Job store backend: "memory" (one process only: a poll landing on another gunicorn worker
+# gets a 404) or "sqlite" (shared by the workers on one host). Unset, it is sqlite only when
+# GUNICORN_WORKERS (exported by gunicorn.conf.py) says there are several workers.
+INSIGHT_JOB_BACKEND = (
+    os.environ.get('INSIGHT_JOB_BACKEND')
+    or ('sqlite' if int(os.environ.get('GUNICORN_WORKERS') or '1') > 1 else 'memory')
+).lower()
+INSIGHT_JOB_DB_PATH = os.environ.get('INSIGHT_JOB_DB_PATH', 'insight_jobs.sqlite3')
+# Threads generating insights, and how many jobs may wait for them
+INSIGHT_JOB_WORKERS = int(os.environ.get('INSIGHT_JOB_WORKERS', '2'))
+INSIGHT_JOB_MAX_PENDING = int(os.environ.get('INSIGHT_JOB_MAX_PENDING', '100'))
+# Active jobs not updated for this long are treated as lost (e.g. the worker died)
+INSIGHT_JOB_STALE_SECONDS = int(os.environ.get('INSIGHT_JOB_STALE_SECONDS', '900'))
+# Finished jobs (and their results) are dropped this long after they finish
+INSIGHT_JOB_RETENTION_SECONDS = int(os.environ.get('INSIGHT_JOB_RETENTION_SECONDS', '3600'))
+# The memory store also keeps at most this many finished jobs, dropping the oldest first
+INSIGHT_JOB_MAX_FINISHED = int(os.environ.get('INSIGHT_JOB_MAX_FINISHED', '1000'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+class QueueFullError(Exception):
+    """Raised when no more insight jobs can be accepted"""
+
+
+def _new_job(user_id):
+    now = datetime.utcnow().isoformat()
+    return {
+        'job_id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'status': QUEUED,
+        'result': None,
+        'error': None,
+        'created_at': now,
+        'updated_at': now,
+    }
+
+
+def _is_stale(job):
+    updated_at = datetime.fromisoformat(job['updated_at'])
+    return datetime.utcnow() - updated_at > timedelta(seconds=INSIGHT_JOB_STALE_SECONDS)
+
+
+def _retention_cutoff():
+    """Finished jobs last updated before this (ISO string) are expired"""
+    return (datetime.utcnow() - timedelta(seconds=INSIGHT_JOB_RETENTION_SECONDS)).isoformat()
+
+
+class JobStore:
+    """Where insight jobs and their results live; subclasses pick the storage"""
+
+    def create_or_get_active(self, user_id):
+        """Return (job, created); an active job for the same user is reused instead of adding another"""
+        raise NotImplementedError
+
+    def get_active(self, user_id):
+        """The user's queued or running job, or None"""
+        raise NotImplementedError
+
+    def get(self, job_id):
+        raise NotImplementedError
+
+    def update(self, job_id, status, result=None, error=None):
+        raise NotImplementedError
+
+
+class InMemoryJobStore(JobStore):
+
+    def __init__(self, max_finished=INSIGHT_JOB_MAX_FINISHED):
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._active = {}
+        # job_ids of finished jobs, oldest first
+        self._finished = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        cutoff = _retention_cutoff()
+        while self._finished:
+            job_id = next(iter(self._finished))
+            if len(self._finished) <= self.max_finished and self._jobs[job_id]['updated_at'] >= cutoff:
+                break
+            del self._finished[job_id]
+            del self._jobs[job_id]
+
+    def create_or_get_active(self, user_id):
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(self._active.get(user_id))
+            if job and job['status'] in ACTIVE_STATUSES and not _is_stale(job):
+                return dict(job), False
+            if job and job['status'] in ACTIVE_STATUSES:
+                # Abandoned: finish it so it expires like any other job
+                job.update(status=FAILED, error='Job was abandoned', updated_at=datetime.utcnow().isoformat())
+                self._finished[job['job_id']] = None
+            job = _new_job(user_id)
+            self._jobs[job['job_id']] = job
+            self._active[user_id] = job['job_id']
+            return dict(job), True
+
+    def get_active(self, user_id):
+        with self._lock:
+            job = self._jobs.get(self._active.get(user_id))
+            if job and job['status'] in ACTIVE_STATUSES and not _is_stale(job):
+                return dict(job)
+            return None
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id, status, result=None, error=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            job.update(status=status, result=result, error=error, updated_at=datetime.utcnow().isoformat())
+            if status not in ACTIVE_STATUSES:
+                self._finished[job_id] = None
+                self._finished.move_to_end(job_id)
+                if self._active.get(job['user_id']) == job_id:
+                    del self._active[job['user_id']]
+
+
+class SQLiteJobStore(JobStore):
+
+    COLUMNS = ('job_id', 'user_id', 'status', 'result', 'error', 'created_at', 'updated_at')
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS insight_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_insight_jobs_user ON insight_jobs (user_id, status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_insight_jobs_updated ON insight_jobs (status, updated_at)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create_or_get_active(self, user_id):
+        conn = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front, so two processes cannot both enqueue
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM insight_jobs WHERE user_id = ? AND status IN (?, ?) ORDER BY created_at DESC LIMIT 1",
+                (user_id, *ACTIVE_STATUSES),
+            ).fetchone()
+            if row and not _is_stale(dict(row)):
+                conn.execute("COMMIT")
+                return dict(row), False
+            if row:
+                conn.execute(
+                    "UPDATE insight_jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                    (FAILED, 'Job was abandoned', datetime.utcnow().isoformat(), row['job_id']),
+                )
+            conn.execute(
+                "DELETE FROM insight_jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (SUCCEEDED, FAILED, _retention_cutoff()),
+            )
+            job = _new_job(user_id)
+            conn.execute(
+                f"INSERT INTO insight_jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                tuple(job[c] for c in self.COLUMNS),
+            )
+            conn.execute("COMMIT")
+            return job, True
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def get_active(self, user_id):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT * FROM insight_jobs WHERE user_id = ? AND status IN (?, ?) ORDER BY created_at DESC LIMIT 1",
+                (user_id, *ACTIVE_STATUSES),
+            ).fetchone()
+            return dict(row) if row and not _is_stale(dict(row)) else None
+        finally:
+            conn.close()
+
+    def get(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM insight_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def update(self, job_id, status, result=None, error=None):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE insight_jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                (status, result, error, datetime.utcnow().isoformat(), job_id),
+            )
+        finally:
+            conn.close()
+
+
+class InsightJobRunner:
+    """Bounded thread pool that runs generate_insights for queued jobs"""
+
+    def __init__(self, store, workers=INSIGHT_JOB_WORKERS, max_pending=INSIGHT_JOB_MAX_PENDING):
+        self.store = store
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='insight-job')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, app, user_id):
+        """Queue insight generation for a user; returns (job, created)"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                # A repeat request for a job already queued or running costs nothing to answer
+                job = self.store.get_active(user_id)
+                if job:
+                    return job, False
+                raise QueueFullError(f'{self._pending} insight jobs already pending')
+            job, created = self.store.create_or_get_active(user_id)
+            if created:
+                self._pending += 1
+        if created:
+            self._executor.submit(self._run, app, job['job_id'], user_id)
+        return job, created
+
+    def _run(self, app, job_id, user_id):
+        from .generate_insights import generate_insights
+
+        try:
+            self.store.update(job_id, RUNNING)
+            with app.app_context():
+                insights = generate_insights(user_id)
+            if isinstance(insights, str) and insights.startswith("Error"):
+                self.store.update(job_id, FAILED, error=insights)
+            else:
+                self.store.update(job_id, SUCCEEDED, result=insights)
+        except Exception as e:
+            logger.exception('Insight job %s failed', job_id)
+            self.store.update(job_id, FAILED, error=f'Error generating insights: {str(e)}')
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        return {'pending': self._pending, 'max_pending': self.max_pending, 'backend': type(self.store).__name__}
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def create_job_store(backend=INSIGHT_JOB_BACKEND):
+    if backend == 'memory':
+        return InMemoryJobStore()
+    if backend == 'sqlite':
+        return SQLiteJobStore(INSIGHT_JOB_DB_PATH)
+    raise ValueError(f"Unknown INSIGHT_JOB_BACKEND: {backend!r}")
+
+
+def get_job_runner():
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = InsightJobRunner(create_job_store())
+                register_metrics('insight_jobs', _runner.stats)
+    return _runner
@@ -0,0 +1,148 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from .insights_chain import InsightBackend
+
+logger = logging.getLogger(__name__)
+
+# Per-call deadline for the remote LLM
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', '20'))
+# LLM calls allowed in flight per process, and how long a caller waits for a slot
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '4'))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('LLM_QUEUE_TIMEOUT_SECONDS', '1'))
+# Consecutive failures that open the breaker, and how long it stays open
+LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_RESET_SECONDS = float(os.environ.get('LLM_BREAKER_RESET_SECONDS', '30'))
+
+
+class DegradedInsight(str):
+    """Insight text produced by the fallback backend; not worth caching as the real answer"""
+
+    degraded = True
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half_open after a cool-down -> closed on success"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """Whether a call may go to the protected backend now"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+            # Half-open: let a single probe through
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning('LLM circuit breaker opened after %d failures', self._failures)
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class ResilientBackend(InsightBackend):
+    """Deadline, concurrency cap and circuit breaker around a remote backend, with a local fallback"""
+
+    def __init__(self, primary, fallback, timeout=LLM_TIMEOUT_SECONDS, max_concurrency=LLM_MAX_CONCURRENCY,
+                 queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS, breaker=None):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = f"{primary.name}+{fallback.name}"
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # One thread per slot; a timed-out call keeps its slot until it really returns
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='llm-call')
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'successes': 0, 'failures': 0, 'timeouts': 0,
+                         'rejected': 0, 'short_circuited': 0, 'fallbacks': 0}
+
+    def _count(self, *names):
+        with self._lock:
+            for name in names:
+                self.counters[name] += 1
+
+    def _fallback(self, stats, reason):
+        self._count('fallbacks')
+        logger.info('Using %s insight backend (%s)', self.fallback.name, reason)
+        return DegradedInsight(self.fallback.generate(stats))
+
+    def generate(self, stats):
+        self._count('calls')
+        # Take a slot before asking the breaker, so a rejected call never holds the half-open probe
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._count('rejected')
+            return self._fallback(stats, 'too many concurrent LLM calls')
+
+        if not self.breaker.allow():
+            self._slots.release()
+            self._count('short_circuited')
+            return self._fallback(stats, 'circuit open')
+
+        try:
+            future = self._executor.submit(self.primary.generate, stats)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self._count('timeouts', 'failures')
+            self.breaker.record_failure()
+            return self._fallback(stats, f'timed out after {self.timeout:.1f}s')
+        except Exception as e:
+            self._count('failures')
+            self.breaker.record_failure()
+            logger.warning('LLM backend call failed: %s', e)
+            return self._fallback(stats, 'backend error')
+
+        self._count('successes')
+        self.breaker.record_success()
+        return result
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {'backend': self.name, 'breaker': self.breaker.state, **counters}
@@ -0,0 +1,110 @@
+from .. import db
+from sqlalchemy import text
+import os
+
+# transaction_daily_rollups is kept updated on every write with ROLLUPS_MAINTAIN and
+# serves insight stats with ROLLUPS_READ (ROLLUPS_ENABLED sets whichever is unset).
+# To switch over: `python manage.py init-db`, deploy with ROLLUPS_MAINTAIN on, run
+# `python manage.py backfill-rollups` (the per-user advisory lock makes this safe
+# against concurrent writes), then turn on ROLLUPS_READ.
+ROLLUPS_ENABLED = os.environ.get('ROLLUPS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+ROLLUPS_MAINTAIN = os.environ.get('ROLLUPS_MAINTAIN', str(ROLLUPS_ENABLED)).lower() in ('1', 'true', 'yes')
+ROLLUPS_READ = os.environ.get('ROLLUPS_READ', str(ROLLUPS_ENABLED)).lower() in ('1', 'true', 'yes')
+if ROLLUPS_READ and not ROLLUPS_MAINTAIN:
+    raise ValueError("ROLLUPS_READ needs ROLLUPS_MAINTAIN, or the rollups go stale")
+
+# Same shape as the transactions stats query, but over at most
+# (days x categories x types) rows per user
+ROLLUP_STATS_SQL = """
+    SELECT
+        GROUPING(category) AS by_category,
+        GROUPING(week) AS by_week,
+        GROUPING(month) AS by_month,
+        category, week, month,
+        SUM(total_amount) AS total,
+        COALESCE(SUM(tx_count) FILTER (WHERE lower(type) = 'income'), 0) AS income_count,
+        COALESCE(SUM(tx_count), 0) AS tx_count
+    FROM (
+        SELECT total_amount, tx_count, type, category,
+               to_char(day, 'IYYY-"W"IW') AS week,
+               to_char(date_trunc('month', day), 'YYYY-MM') AS month
+        FROM transaction_daily_rollups
+        WHERE user_id = :user_id
+    ) r
+    GROUP BY GROUPING SETS ((), (category), (week), (month))
+    ORDER BY category, week, month
+"""
+
+
+def _lock_user(user_id):
+    # Serializes rollup writers with a backfill of the same user until commit
+    db.session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:user_id))"), {'user_id': str(user_id)})
+
+
+def apply_transactions(user_id, transactions):
+    """Add newly inserted transactions to the user's rollups, inside the caller's DB transaction"""
+    if not ROLLUPS_MAINTAIN or not transactions:
+        return
+
+    totals = {}
+    for tx in transactions:
+        key = (str(tx['date']), tx.get('category') or 'other', tx['type'])
+        amount, count = totals.get(key, (0, 0))
+        totals[key] = (amount + (tx.get('amount') or 0), count + 1)
+
+    # Same chunking as insert_transactions, to stay under Postgres' bind parameter limit
+    from ..api.raw_records import TRANSACTION_INSERT_BATCH_SIZE
+
+    _lock_user(user_id)
+    # Sorted keys give concurrent writers a consistent row-lock order
+    items = sorted(totals.items())
+    for start in range(0, len(items), TRANSACTION_INSERT_BATCH_SIZE):
+        values = []
+        params = {'user_id': str(user_id)}
+        for i, (key, (amount, count)) in enumerate(items[start:start + TRANSACTION_INSERT_BATCH_SIZE]):
+            values.append(f"(:user_id, :day_{i}, :category_{i}, :type_{i}, :amount_{i}, :count_{i})")
+            params.update({
+                f'day_{i}': key[0], f'category_{i}': key[1], f'type_{i}': key[2],
+                f'amount_{i}': amount, f'count_{i}': count,
+            })
+
+        db.session.execute(text(
+            "INSERT INTO transaction_daily_rollups (user_id, day, category, type, total_amount, tx_count) VALUES "
+            + ", ".join(values)
+            + """
+            ON CONFLICT (user_id, day, category, type) DO UPDATE SET
+                total_amount = transaction_daily_rollups.total_amount + EXCLUDED.total_amount,
+                tx_count = transaction_daily_rollups.tx_count + EXCLUDED.tx_count
+            """
+        ), params)
+
+
+def backfill_user(user_id):
+    """Rebuild one user's rollups from the transactions table and commit"""
+    _lock_user(user_id)
+    db.session.execute(text("DELETE FROM transaction_daily_rollups WHERE user_id = :user_id"), {'user_id': str(user_id)})
+    result = db.session.execute(text("""
+        INSERT INTO transaction_daily_rollups (user_id, day, category, type, total_amount, tx_count)
+        SELECT user_id, date, COALESCE(category, 'other'), type, COALESCE(SUM(amount), 0), COUNT(*)
+        FROM transactions
+        WHERE user_id = :user_id AND date IS NOT NULL AND type IS NOT NULL
+        GROUP BY user_id, date, COALESCE(category, 'other'), type
+    """), {'user_id': user_id})
+    db.session.commit()
+    return result.rowcount
+
+
+def iter_user_ids(after=None, chunk_size=1000):
+    """Yield every user_id with transactions, in order, a chunk at a time"""
+    while True:
+        rows = db.session.execute(text("""
+            SELECT DISTINCT user_id::text AS user_id FROM transactions
+            WHERE (CAST(:after AS TEXT) IS NULL OR user_id::text > :after)
+            ORDER BY 1
+            LIMIT :limit
+        """), {'after': after, 'limit': chunk_size}).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row.user_id
+        after = rows[-1].user_id
@@ -0,0 +1,43 @@
+import os
+
+
+def _read_kb_fields(path, fields):
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in fields:
+                    values[name] = int(rest.split()[0])
+    except (OSError, ValueError, IndexError):
+        pass
+    return values
+
+
+def process_memory(pid='self'):
+    """RSS/PSS and shared/private split of a process in kB, from /proc (Linux only; empty elsewhere)"""
+    status = _read_kb_fields(f'/proc/{pid}/status', {'VmRSS'})
+    rollup = _read_kb_fields(
+        f'/proc/{pid}/smaps_rollup',
+        {'Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty'},
+    )
+    if not status and not rollup:
+        return {}
+    memory = {'pid': os.getpid() if pid == 'self' else int(pid), 'rss_kb': rollup.get('Rss', status.get('VmRSS'))}
+    if rollup:
+        memory.update({
+            'pss_kb': rollup.get('Pss'),
+            'shared_kb': rollup.get('Shared_Clean', 0) + rollup.get('Shared_Dirty', 0),
+            # Unique set size: what exiting this process would give back
+            'private_kb': rollup.get('Private_Clean', 0) + rollup.get('Private_Dirty', 0),
+        })
+    return memory
+
+
+def child_pids(pid):
+    """Direct children of a process (e.g. the workers of a gunicorn master)"""
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
@@ -0,0 +1,22 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# name -> zero-argument callable returning a JSON-serializable dict
+_collectors = {}
+
+
+def register_metrics(name, collector):
+    """Expose a component's counters under /metrics"""
+    _collectors[name] = collector
+
+
+def collect_metrics():
+    metrics = {}
+    for name, collector in list(_collectors.items()):
+        try:
+            metrics[name] = collector()
+        except Exception:
+            logger.exception('Metrics collector %s failed', name)
+            metrics[name] = None
+    return metrics
@@ -0,0 +1,75 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Load heavy resources when the app is created:
+#   none       - load each one on first use; /ready does not wait for them
+#   sync       - load them inside create_app() (blocks worker boot)
+#   background - load them on a thread; /ready answers 503 until they are in
+WARMUP_MODES = ('none', 'sync', 'background')
+WARMUP_ON_START = os.environ.get('WARMUP_ON_START', 'none').strip().lower()
+if WARMUP_ON_START not in WARMUP_MODES:
+    raise ValueError(f"WARMUP_ON_START must be one of {', '.join(WARMUP_MODES)}, got {WARMUP_ON_START!r}")
+
+# name -> (loader, is_loaded); both zero-argument callables
+_resources = {}
+_errors = {}
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+
+
+def register_resource(name, loader, is_loaded):
+    """Declare a lazily loaded resource that warmup should load and /ready should wait for"""
+    _resources[name] = (loader, is_loaded)
+
+
+def warmup():
+    """Load every registered resource that is not loaded yet"""
+    for name, (loader, is_loaded) in list(_resources.items()):
+        if is_loaded():
+            continue
+        start = time.time()
+        try:
+            loader()
+            _errors.pop(name, None)
+            logger.info('Warmed up %s in %.2fs', name, time.time() - start)
+        except Exception as e:
+            logger.exception('Warmup of %s failed', name)
+            _errors[name] = str(e)
+
+
+def start_warmup(mode=WARMUP_ON_START):
+    global _warmup_thread
+    if mode == 'sync':
+        warmup()
+    elif mode == 'background':
+        with _warmup_lock:
+            if _warmup_thread is None or not _warmup_thread.is_alive():
+                _warmup_thread = threading.Thread(target=warmup, name='warmup', daemon=True)
+                _warmup_thread.start()
+
+
+def wait_for_warmup(timeout=None):
+    """Block until a background warmup started by start_warmup has finished"""
+    thread = _warmup_thread
+    if thread is not None:
+        thread.join(timeout)
+
+
+def readiness(mode=WARMUP_ON_START):
+    """Return (ready, {resource: state}) for the /ready endpoint"""
+    states = {}
+    for name, (_, is_loaded) in list(_resources.items()):
+        if is_loaded():
+            states[name] = 'loaded'
+        elif name in _errors:
+            states[name] = f'error: {_errors[name]}'
+        elif mode == 'none':
+            states[name] = 'lazy'
+        else:
+            states[name] = 'loading'
+    ready = all(state in ('loaded', 'lazy') for state in states.values())
+    return ready, states
@@ -0,0 +1,39 @@
+from sqlalchemy import text
+from . import db
+
+# Objects and columns this service manages on top of the base raw_entries/
+# transactions/insights tables. Every statement is idempotent so
+# ensure_schema() can run on each deploy.
+SCHEMA_STATEMENTS = [
+    # Keyset pagination for GET /transactions/<user_id>
+    """
+    CREATE INDEX IF NOT EXISTS idx_transactions_user_created
+    ON transactions (user_id, created_at DESC, transaction_id DESC)
+    """,
+    # Fingerprint of the stats an insight was generated from (see generate_insights)
+    "ALTER TABLE insights ADD COLUMN IF NOT EXISTS stats_hash TEXT",
+    # Latest-insight lookups
+    """
+    CREATE INDEX IF NOT EXISTS idx_insights_user_created
+    ON insights (user_id, created_at DESC)
+    """,
+    # Per-user daily/category totals maintained on write (see app/insights/rollups.py)
+    """
+    CREATE TABLE IF NOT EXISTS transaction_daily_rollups (
+        user_id TEXT NOT NULL,
+        day DATE NOT NULL,
+        category TEXT NOT NULL,
+        type TEXT NOT NULL,
+        total_amount NUMERIC NOT NULL DEFAULT 0,
+        tx_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, category, type)
+    )
+    """,
+]
+
+
+def ensure_schema():
+    """Create any missing tables and indexes"""
+    for statement in SCHEMA_STATEMENTS:
+        db.session.execute(text(statement))
+    db.session.commit()
@@ -0,0 +1,62 @@
+"""
+Gunicorn settings for LazyLedger-Parser
+Run with `gunicorn -c gunicorn.conf.py wsgi:application`
+
+With preload (the default) the app, the spaCy model and the insight backend are
+loaded once in the master and shared copy-on-write by the forked workers.
+Compare per-worker memory with `python manage.py worker-memory <master pid>`.
+"""
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+# The app reads this too (e.g. to pick a job store shared by the workers)
+os.environ['GUNICORN_WORKERS'] = str(workers)
+# threads > 1 switches to gthread workers; RAW_RECORD_BUFFER_DURABILITY=sync only batches
+# records across concurrent requests in one worker, so it needs this
+threads = int(os.environ.get('GUNICORN_THREADS', '1'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+
+def when_ready(server):
+    """Runs in the master once the app is loaded, before any worker is forked"""
+    from app.api.ingest_buffer import RAW_RECORD_BUFFER_DURABILITY, RAW_RECORD_BUFFER_ENABLED
+
+    if RAW_RECORD_BUFFER_ENABLED and RAW_RECORD_BUFFER_DURABILITY == 'sync' and server.cfg.threads <= 1:
+        server.log.warning("RAW_RECORD_BUFFER_DURABILITY=sync with one thread per worker writes one record "
+                           "per batch; set GUNICORN_THREADS > 1 to batch")
+    if not server.cfg.preload_app:
+        return
+    from app.memory import process_memory
+    from app.readiness import wait_for_warmup, warmup
+
+    # Load everything here so workers inherit it instead of loading their own copy
+    wait_for_warmup()
+    warmup()
+    # Move what exists now out of the GC's reach; collections in the workers would
+    # otherwise write to these objects' headers and un-share their pages
+    gc.collect()
+    gc.freeze()
+    server.log.info("Preloaded app in master: %s", process_memory())
+
+
+def post_fork(server, worker):
+    """Give each worker its own DB connections instead of sockets inherited from the master"""
+    if not server.cfg.preload_app:
+        return
+    from app import db
+
+    app = server.app.wsgi()
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False leaves the master's connections alone; the worker just forgets them
+            engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    from app.memory import process_memory
+
+    worker.log.info("Worker ready: %s", process_memory())
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Maintenance commands for LazyLedger-Parser
+Run `python manage.py --help` to list them
+"""
+
+import time
+
+import typer
+
+from app import create_app
+
+cli = typer.Typer(help="LazyLedger maintenance commands")
+
+
+@cli.command('init-db')
+def init_db():
+    """Create the tables and indexes this service manages (safe to re-run)."""
+    from app.schema import ensure_schema
+
+    with create_app().app_context():
+        ensure_schema()
+    typer.echo("Schema is up to date")
+
+
+@cli.command('backfill-rollups')
+def backfill_rollups(
+    user_id: str = typer.Option(None, help="Only rebuild this user's rollups"),
+    after: str = typer.Option(None, help="Resume after this user_id"),
+):
+    """Rebuild transaction_daily_rollups from the transactions table, one user per commit."""
+    from app.insights.rollups import backfill_user, iter_user_ids
+
+    start = time.time()
+    users = rows = 0
+    with create_app().app_context():
+        user_ids = [user_id] if user_id else iter_user_ids(after=after)
+        for uid in user_ids:
+            rows += backfill_user(uid)
+            users += 1
+            if users % 100 == 0:
+                typer.echo(f"{users} users backfilled (last user_id: {uid})")
+    typer.echo(f"Backfilled {rows} rollup rows for {users} users in {time.time() - start:.1f}s")
+
+
+@cli.command('bench-stats')
+def bench_stats(
+    rows: list[int] = typer.Option([100_000, 1_000_000], help="Synthetic transaction counts to benchmark"),
+    seed: int = typer.Option(0, help="Random seed for the synthetic data"),
+):
+    """Compare calculate_stats with the columnar NumPy engine on synthetic data."""
+    import numpy as np
+    from app.insights.columnar_stats import TransactionColumns, calculate_stats_columnar
+    from app.insights.generate_insights import calculate_stats
+
+    rng = np.random.default_rng(seed)
+    categories = ['groceries', 'entertainment', 'salary', 'freelance', 'transport', 'bills', 'food', 'other']
+    for n in rows:
+        amounts = np.round(rng.uniform(1, 5000, n), 2)
+        days = np.datetime64('2019-01-01') + rng.integers(0, 6 * 365, n)
+        cats = rng.choice(categories, n)
+        types = rng.choice(['income', 'expense'], n, p=[0.1, 0.9])
+        tx_rows = [
+            {'amount': float(a), 'date': str(d), 'category': str(c), 'type': str(t)}
+            for a, d, c, t in zip(amounts, days, cats, types)
+        ]
+
+        start = time.perf_counter()
+        dict_stats = calculate_stats({'transactions': tx_rows})
+        dict_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        columns = TransactionColumns.from_rows(tx_rows)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        columnar_stats = calculate_stats_columnar(columns)
+        columnar_time = time.perf_counter() - start
+
+        matches = (
+            abs(dict_stats['total_amount'] - columnar_stats['total_amount']) < 1e-6 * n
+            and dict_stats['income_count'] == columnar_stats['income_count']
+            and dict_stats['monthly_totals'].keys() == columnar_stats['monthly_totals'].keys()
+            and dict_stats['weekly_totals'].keys() == columnar_stats['weekly_totals'].keys()
+        )
+        typer.echo(
+            f"{n:>10,} rows  dict: {dict_time * 1000:9.1f} ms  "
+            f"columnar: {columnar_time * 1000:8.1f} ms ({dict_time / columnar_time:5.1f}x)  "
+            f"columnar incl. build: {(build_time + columnar_time) * 1000:9.1f} ms  "
+            f"totals match: {matches}"
+        )
+
+
+@cli.command('generate-insights')
+def generate_insights_batch(
+    user_id: list[str] = typer.Option(None, help="Only these users (repeatable); default is every user with transactions"),
+    workers: int = typer.Option(None, help="Worker processes [default: INSIGHT_BATCH_WORKERS]"),
+    chunk_size: int = typer.Option(None, help="Users per chunk [default: INSIGHT_BATCH_CHUNK_SIZE]"),
+    checkpoint: str = typer.Option('insights_batch.checkpoint',
+                                   help="File recording finished users; removed once a run ends with no failures"),
+    resume: bool = typer.Option(True, help="Skip users an interrupted or failed run finished; --no-resume starts over"),
+):
+    """Precompute insights for all users across a process pool (e.g. nightly)."""
+    import os
+
+    from app.insights.batch import INSIGHT_BATCH_CHUNK_SIZE, INSIGHT_BATCH_WORKERS, percentile, run_insight_batch
+    from app.insights.rollups import iter_user_ids
+
+    if not resume and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    def progress(summary, elapsed):
+        typer.echo(f"{summary['users']} users done ({summary['generated']} generated, "
+                   f"{summary['reused']} unchanged, {summary['failed']} failed), "
+                   f"{summary['users'] / elapsed:.1f} users/s")
+
+    with create_app().app_context():
+        user_ids = user_id or list(iter_user_ids())
+    summary = run_insight_batch(
+        user_ids,
+        workers=workers or INSIGHT_BATCH_WORKERS,
+        chunk_size=chunk_size or INSIGHT_BATCH_CHUNK_SIZE,
+        checkpoint=checkpoint,
+        on_progress=progress,
+    )
+
+    latencies = summary['latencies']
+    duration = summary['duration_seconds']
+    typer.echo(
+        f"Processed {summary['users']} users in {duration:.1f}s "
+        f"({summary['users'] / duration if duration else 0:.1f} users/s); "
+        f"{summary['generated']} generated, {summary['reused']} unchanged, {summary['failed']} failed, "
+        f"{summary['skipped']} skipped from checkpoint"
+    )
+    typer.echo(f"Per-user latency: p50 {percentile(latencies, 50) * 1000:.0f} ms, "
+               f"p95 {percentile(latencies, 95) * 1000:.0f} ms, max {max(latencies, default=0) * 1000:.0f} ms")
+    if summary['failed']:
+        raise typer.Exit(1)
+
+
+@cli.command('worker-memory')
+def worker_memory(pid: int = typer.Argument(..., help="PID of the gunicorn master")):
+    """Show RSS/PSS of a gunicorn master and its workers (run with and without GUNICORN_PRELOAD to compare)."""
+    from app.memory import child_pids, process_memory
+
+    rows = [('master', process_memory(pid))] + [('worker', process_memory(child)) for child in child_pids(pid)]
+    typer.echo(f"{'role':<8} {'pid':>8} {'rss MB':>9} {'pss MB':>9} {'shared MB':>10} {'private MB':>11}")
+    for role, mem in rows:
+        if not mem:
+            continue
+        typer.echo(
+            f"{role:<8} {mem['pid']:>8} {mem['rss_kb'] / 1024:>9.1f} {(mem.get('pss_kb') or 0) / 1024:>9.1f} "
+            f"{mem.get('shared_kb', 0) / 1024:>10.1f} {mem.get('private_kb', 0) / 1024:>11.1f}"
+        )
+    workers = [mem for role, mem in rows if role == 'worker' and mem]
+    if workers:
+        total_pss = sum(mem.get('pss_kb') or 0 for _, mem in rows if mem) / 1024
+        avg_rss = sum(mem['rss_kb'] for mem in workers) / len(workers) / 1024
+        typer.echo(f"{len(workers)} workers, avg worker RSS {avg_rss:.1f} MB, total PSS {total_pss:.1f} MB")
+
+
+@cli.command('bench-ingest')
+def bench_ingest(
+    requests: int = typer.Option(2000, help="Number of /raw-records/create calls"),
+    concurrency: int = typer.Option(16, help="Client threads"),
+    user_prefix: str = typer.Option('bench-ingest', help="user_id prefix for the generated records"),
+):
+    """Drive /raw-records/create in-process; run with RAW_RECORD_BUFFER_ENABLED on and off to compare."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from app.api.ingest_buffer import RAW_RECORD_BUFFER_ENABLED
+    from app.insights.batch import percentile
+    from app.metrics import collect_metrics
+
+    app = create_app()
+    client = app.test_client()
+
+    def create(i):
+        start = time.perf_counter()
+        response = client.post('/raw-records/create', json={
+            'user_id': f'{user_prefix}-{i % 50}',
+            'date': '2024-01-01',
+            'raw_text': f'coffee {i % 20 + 1}\nbus {i % 7 + 1}',
+        })
+        return response.status_code, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(create, range(requests)))
+    duration = time.perf_counter() - start
+
+    latencies = [latency for _, latency in results]
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    typer.echo(f"buffer {'on' if RAW_RECORD_BUFFER_ENABLED else 'off'}: {requests} requests in {duration:.2f}s "
+               f"({requests / duration:.0f} req/s), statuses {statuses}")
+    typer.echo(f"latency p50 {percentile(latencies, 50) * 1000:.1f} ms, p95 {percentile(latencies, 95) * 1000:.1f} ms")
+    buffer_stats = collect_metrics().get('raw_record_buffer')
+    if buffer_stats:
+        typer.echo(f"batches {buffer_stats['batches']}, avg batch size {buffer_stats['avg_batch_size']:.1f}, "
+                   f"avg flush {buffer_stats['avg_flush_ms']:.1f} ms, max flush {buffer_stats['flush_seconds_max'] * 1000:.1f} ms")
+
+
+@cli.command('stub-llm')
+def stub_llm(
+    port: int = typer.Option(8089, help="Port to listen on"),
+    latency: float = typer.Option(0.0, help="Seconds to sleep before answering"),
+    error_rate: float = typer.Option(0.0, help="Fraction of requests answered with HTTP 503"),
+):
+    """Serve a fake text-generation endpoint for exercising the LLM timeout and circuit breaker.
+
+    Point the app at it with HUGGINGFACE_ENDPOINT_URL=http://127.0.0.1:<port>.
+    """
+    import json
+    import random
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            time.sleep(latency)
+            if random.random() < error_rate:
+                self.send_response(503)
+                self.end_headers()
+                return
+            body = json.dumps([{'generated_text': 'Summary: stub insight.'}]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    typer.echo(f"Stub LLM on http://127.0.0.1:{port} (latency {latency}s, error rate {error_rate:.0%})")
+    ThreadingHTTPServer(('127.0.0.1', port), Handler).serve_forever()
+
+
+if __name__ == '__main__':
+    cli()